@@ -0,0 +1,52 @@
+""" Compare fixed and adaptive Gerrit batch sizes against StubGerrit.
+
+usage: python benchmarks/bench_batching.py [n_shas] [latency] [max_terms]
+
+The stub answers in `latency` seconds plus 1 ms per term and refuses
+queries of more than `max_terms` terms (400) or 8000 bytes (414).
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import gerrit.get_rawdata as gerrit
+from stub_gerrit import StubGerrit
+
+
+def run(S, numbers, dst, sizer=None, nmax=75):
+    req = gerrit.connect(S.url, netrc=False, pool_size=4)
+    if sizer is not None:
+        sizer = gerrit.BatchSizer(req, nmax)
+    S.requests = 0
+    t0 = time.time()
+    C = gerrit.fetch_changes(numbers, nmax=nmax, workers=4, req=req,
+                             dst=dst, sizer=sizer)
+    if len(C.data) != len(numbers):
+        raise Exception("%d changes for %d SHAs" % (len(C.data),
+                                                    len(numbers)))
+    return time.time() - t0, S.requests
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    max_terms = int(sys.argv[3]) if len(sys.argv) > 3 else 150
+    numbers = [hashlib.sha1(str(i)).hexdigest() for i in range(n)]
+    S = StubGerrit(latency=latency, per_term=0.001, max_url=8000,
+                   max_terms=max_terms).start()
+    dst = tempfile.mkdtemp()
+    try:
+        fixed = run(S, numbers, dst)
+        adaptive = run(S, numbers, dst, sizer=True)
+    finally:
+        shutil.rmtree(dst)
+        S.shutdown()
+    print "fixed (75):  %.2fs, %d requests" % fixed
+    print "adaptive:    %.2fs, %d requests" % adaptive
+    print "speedup:     %.1fx" % (fixed[0] / adaptive[0])
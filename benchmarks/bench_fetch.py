@@ -0,0 +1,53 @@
+""" Compare serial and pooled batch fetching against StubGerrit.
+
+usage: python benchmarks/bench_fetch.py [n_shas] [latency] [workers]
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pygerrit import rest
+import gerrit.get_rawdata as gerrit
+from stub_gerrit import StubGerrit
+
+
+def serial(url, numbers, nmax, dst):
+    """Old behaviour: one new session per batch, one batch at a time."""
+    for i in range(0, len(numbers), nmax):
+        B = gerrit.Base(numbers=numbers[i:i + nmax], dst=dst,
+                        req=rest.GerritRestAPI(url, verify=False))
+        gerrit.Changes(B)
+
+
+def pooled(url, numbers, nmax, dst, workers):
+    req = gerrit.connect(url, netrc=False, pool_size=workers)
+    gerrit.fetch_changes(numbers, nmax=nmax, workers=workers, req=req,
+                         dst=dst)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    numbers = [hashlib.sha1(str(i)).hexdigest() for i in range(n)]
+    S = StubGerrit(latency=latency).start()
+    dst = tempfile.mkdtemp()
+    try:
+        t0 = time.time()
+        serial(S.url, numbers, 75, dst)
+        t_serial = time.time() - t0
+        t0 = time.time()
+        pooled(S.url, numbers, 75, dst, workers)
+        t_pooled = time.time() - t0
+    finally:
+        shutil.rmtree(dst)
+        S.shutdown()
+    print "serial:          %.2fs" % t_serial
+    print "pooled (%2d thr): %.2fs" % (workers, t_pooled)
+    print "speedup:         %.1fx" % (t_serial / t_pooled)
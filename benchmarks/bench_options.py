@@ -0,0 +1,59 @@
+""" Compare Gerrit payloads and fetch times per exported table.
+
+usage: python benchmarks/bench_options.py [n_shas] [files_per_change]
+
+Every table set is fetched from StubGerrit with the query options
+gerrit.query_options() plans for it; bytes are counted as they come
+over the wire (gzipped).
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import gerrit.get_rawdata as gerrit
+import profiling
+import stub_gerrit
+from stub_gerrit import StubGerrit
+
+
+def run(S, numbers, dst, tables):
+    req = gerrit.connect(S.url, netrc=False, pool_size=4)
+    options = gerrit.query_options(tables)
+    profiling.reset()
+    t0 = time.time()
+    E = gerrit.Export(dst, "bench", tables)
+    try:
+        for changes in gerrit.iter_changes(numbers, workers=4, req=req,
+                                           dst=dst, options=options):
+            E.write(changes.data)
+    finally:
+        E.close()
+    return (time.time() - t0,
+            profiling.snapshot()['counters']['gerrit bytes'])
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    fake_change = stub_gerrit.fake_change
+    stub_gerrit.fake_change = lambda term: fake_change(term, revisions=4,
+                                                       files=files)
+    numbers = [hashlib.sha1(str(i)).hexdigest() for i in range(n)]
+    S = StubGerrit(latency=0.0).start()
+    dst = tempfile.mkdtemp()
+    try:
+        full = run(S, numbers, dst, gerrit.TABLES)
+        print "%-28s %6.2fs %9d bytes" % ("all tables", full[0], full[1])
+        for table in gerrit.TABLES:
+            t, size = run(S, numbers, dst, (table,))
+            print "%-28s %6.2fs %9d bytes (%.0f%%)" % (
+                table, t, size, 100.0 * size / full[1])
+    finally:
+        shutil.rmtree(dst)
+        S.shutdown()
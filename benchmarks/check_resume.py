@@ -0,0 +1,100 @@
+""" Check that an interrupted gerrit run resumes to the same output.
+
+usage: python benchmarks/check_resume.py
+
+A first run fills the ChangeCache from StubGerrit; every other cached
+change is then made open again, so a warm run exports the closed ones
+from the cache and queries the open ones by change number.  One copy of
+that cache is exported in a single run; on another the run is killed by
+an unreachable Gerrit after the cached batches are written, then run
+again with --resume.  Both exports must be byte-identical.
+"""
+
+import filecmp
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import synth
+from stub_gerrit import StubGerrit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+GET_DATA = os.path.join(ROOT, "get-data")
+UNREACHABLE = "http://127.0.0.1:9"
+
+
+def get_data(cwd, args):
+    """Run get-data in cwd; return its exit code."""
+    with open(os.path.join(cwd, "stdout.log"), "a") as log:
+        return subprocess.call([sys.executable, GET_DATA] + args, cwd=cwd,
+                               stdout=log, stderr=subprocess.STDOUT)
+
+
+def reopen(cache):
+    """Mark every other cached change as open; return how many."""
+    db = sqlite3.connect(cache)
+    numbers = [row[0] for row in
+               db.execute("SELECT number FROM changes ORDER BY number")]
+    db.executemany("UPDATE changes SET status='NEW' WHERE number=?",
+                   [(x,) for x in numbers[::2]])
+    db.commit()
+    db.close()
+    return len(numbers[::2])
+
+
+def run(work):
+    tree = os.path.join(work, "tree")
+    manifests = synth.make_tree(tree, projects=4, commits=60, files=3,
+                                snapshots=2)
+    S = StubGerrit(latency=0.0).start()
+    args = ["batch", "gerrit", tree] + manifests + ["--no-netrc",
+                                                    "--batch-size=20",
+                                                    "--retries=1"]
+    try:
+        seed = os.path.join(work, "seed")
+        os.makedirs(seed)
+        if get_data(seed, args + ["--url=" + S.url]):
+            raise Exception("seed run failed, see %s/stdout.log" % seed)
+        cache = os.path.join(seed, "result-gerrit", "changes.sqlite")
+        print "reopened: %d cached changes" % reopen(cache)
+        runs = {}
+        for name in ("whole", "resumed"):
+            runs[name] = os.path.join(work, name)
+            os.makedirs(os.path.join(runs[name], "result-gerrit"))
+            shutil.copy(cache, os.path.join(runs[name], "result-gerrit"))
+        if get_data(runs["whole"], args + ["--url=" + S.url]):
+            raise Exception("whole run failed")
+        if not get_data(runs["resumed"], args + ["--url=" + UNREACHABLE]):
+            raise Exception("run against an unreachable Gerrit passed")
+        if get_data(runs["resumed"], args + ["--url=" + S.url, "--resume"]):
+            raise Exception("resumed run failed")
+    finally:
+        S.shutdown()
+    outputs = sorted(f for f in os.listdir(os.path.join(runs["whole"],
+                                                        "result-gerrit"))
+                     if f.endswith(".csv"))
+    same = True
+    for f in outputs:
+        paths = [os.path.join(runs[name], "result-gerrit", f)
+                 for name in ("whole", "resumed")]
+        ok = filecmp.cmp(paths[0], paths[1], shallow=False)
+        print "%-40s %6d rows %s" % (f, sum(1 for _ in open(paths[0])) - 1,
+                                     ok and "same" or "DIFFERENT")
+        same = same and ok
+    return same
+
+
+if __name__ == "__main__":
+    work = tempfile.mkdtemp()
+    try:
+        same = run(work)
+    finally:
+        shutil.rmtree(work)
+    if not same:
+        raise Exception("resumed export differs from a single run")
+    print "resume: ok"
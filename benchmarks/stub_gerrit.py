@@ -0,0 +1,188 @@
+""" Minimal local stand-in for Gerrit's changes/ REST endpoint."""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import hashlib
+import json
+import re
+import threading
+import time
+import urlparse
+import zlib
+
+MAGIC_PREFIX = ")]}'\n"
+
+
+def fake_change(term, revisions=2, files=3, messages=4):
+    """Return a ChangeInfo dict for a query term (number or SHA)."""
+    number = int(hashlib.md5(term).hexdigest()[:6], 16)
+    change_id = "I" + hashlib.sha1(term).hexdigest()
+    revs = {}
+    msgs = []
+    for n in range(1, revisions + 1):
+        sha = term if n == revisions and len(term) == 40 else \
+              hashlib.sha1("%s-%d" % (term, n)).hexdigest()
+        revs[sha] = {
+            '_number': n,
+            'commit': {'committer': {'email': 'dev@sony.com',
+                                     'date': '2016-01-0%d 10:00:00.000000000' % n},
+                       'message': 'Change %d\n\nChange-Id: %s\n' % (number, change_id)},
+            'files': dict(('src/File%d.java' % f,
+                           {'lines_inserted': f + 1, 'lines_deleted': f})
+                          for f in range(files)),
+        }
+        msgs.append({'_revision_number': n, 'date': '2016-01-0%d 10:00:00.000000000' % n,
+                     'author': {'name': 'Dev'}, 'message': 'Uploaded patch set %d.' % n})
+    for m in range(messages):
+        msgs.append({'_revision_number': revisions,
+                     'date': '2016-01-09 10:00:00.000000000',
+                     'author': {'name': 'CI Bot'}, 'message': 'Patch Set %d: Verified+1' % revisions})
+    msgs.append({'_revision_number': revisions, 'date': '2016-01-10 10:00:00.000000000',
+                 'message': 'Change has been successfully merged into the git repository.'})
+    current = [s for s in revs if revs[s]['_number'] == revisions][0]
+    return {'_number': number, 'change_id': change_id, 'project': 'platform/test',
+            'branch': 'master', 'status': 'MERGED', 'current_revision': current,
+            'created': '2016-01-01 10:00:00.000000000',
+            'updated': '2016-01-10 10:00:00.000000000',
+            'revisions': revs, 'messages': msgs}
+
+
+def with_options(c, options):
+    """Return change c as Gerrit sends it for the query options."""
+    c = dict(c)
+    current = c['current_revision']
+    if 'MESSAGES' not in options:
+        del c['messages']
+    if 'ALL_REVISIONS' in options:
+        shas = list(c['revisions'])
+    elif 'CURRENT_REVISION' in options:
+        shas = [current]
+    else:
+        del c['revisions'], c['current_revision']
+        return c
+    revs = {}
+    for sha in shas:
+        r = dict(c['revisions'][sha])
+        if 'ALL_COMMITS' not in options and \
+           ('CURRENT_COMMIT' not in options or sha != current):
+            del r['commit']
+        if 'ALL_FILES' not in options and \
+           ('CURRENT_FILES' not in options or sha != current):
+            del r['files']
+        revs[sha] = r
+    c['revisions'] = revs
+    return c
+
+
+def branch_changes(project, branch, n):
+    """Return n changes of project/branch, one updated per minute."""
+    changes = []
+    for i in range(n):
+        c = fake_change("%s:%s:%d" % (project, branch, i))
+        c['project'] = project
+        c['branch'] = branch
+        c['updated'] = "2016-02-%02d %02d:%02d:00.000000000" % \
+                       (1 + i / 1440, i / 60 % 24, i % 60)
+        changes.append(c)
+    changes.reverse()  # newest first, like Gerrit
+    return changes
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    """Answer GET /changes/ queries with fake changes.
+
+    "a OR b" yields one change per term; "project:p branch:b" yields
+    `branch_size` changes, honouring after:, S= and `page_size`.  Request
+    lines longer than `max_url` get 414, queries of more than
+    `max_terms` terms get 400.  Changes carry what the o= options ask
+    for, and answers are gzipped if the client accepts it.
+    """
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if not url.path.rstrip('/').endswith('changes'):
+            self.send_error(404)
+            return
+        self.server.requests += 1
+        if self.server.max_url and len(self.path) > self.server.max_url:
+            self.send_error(414)
+            return
+        params = urlparse.parse_qs(url.query)
+        query = params.get('q', [''])[0]
+        n_terms = len(query.split(' OR '))
+        if self.server.max_terms and n_terms > self.server.max_terms:
+            self.send_error(400)
+            return
+        time.sleep(self.server.latency + self.server.per_term * n_terms)
+        if query.startswith('project:'):
+            terms = dict(t.split(':', 1) for t in
+                         re.findall(r'(\w+:"[^"]*"|\S+)', query))
+            changes = branch_changes(terms['project'], terms['branch'],
+                                     self.server.branch_size)
+            if 'after' in terms:
+                after = terms['after'].strip('"')
+                changes = [c for c in changes if c['updated'][:19] >= after]
+            start = int(params.get('S', ['0'])[0])
+            changes = changes[start:start + self.server.page_size + 1]
+            if len(changes) > self.server.page_size:
+                changes = changes[:-1]
+                changes[-1]['_more_changes'] = True
+        else:
+            terms = [t for t in query.replace('+', ' ').split(' ')
+                     if t and t != 'OR']
+            changes = [fake_change(t) for t in terms]
+        options = set(params.get('o', []))
+        body = MAGIC_PREFIX + json.dumps([with_options(c, options)
+                                          for c in changes])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            z = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = z.compress(body) + z.flush()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubGerrit(ThreadingMixIn, HTTPServer):
+
+    """Threaded stub server.
+
+    Each reply takes `latency` seconds plus `per_term` per query term.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.05, branch_size=0, page_size=500,
+                 per_term=0.0, max_url=0, max_terms=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.latency = latency
+        self.per_term = per_term
+        self.max_url = max_url
+        self.max_terms = max_terms
+        self.branch_size = branch_size
+        self.page_size = page_size
+        self.requests = 0
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+
+if __name__ == "__main__":
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    S = StubGerrit(port=port)
+    print "Serving %s" % S.url
+    S.serve_forever()
@@ -0,0 +1,213 @@
+""" Offline end-to-end benchmark of every get-data subcommand.
+
+usage: python benchmarks/suite.py run [--key=value ...]
+       python benchmarks/suite.py compare <old.json> <new.json>
+
+"run" builds a synthetic tree with synth.py, starts StubGerrit and runs
+get-data snapshot, git, files, gerrit and batch as separate processes,
+each with --profile.  Every case runs cold (--no-cache, fresh working
+directory) and warm (second run over the caches of a first one).  The
+report holds the wall time of every run and the per-stage profile of
+the median one, tagged with the code revision, so reports of two
+commits made with the same options can be compared with "compare".
+
+Options (defaults in brackets):
+  --projects=N [10] --commits=N [200] --files=N [5] --snapshots=N [3]
+  --latency=S [0.05] --per-term=S [0.001] --max-terms=N [0]
+  --workers=N [4] --repeat=N [3] --cases=a,b,... [all]
+  --work=DIR [temporary] keep and reuse the synthetic tree
+  --out=FILE [bench-<revision>.json]
+"""
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import synth
+from stub_gerrit import StubGerrit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+GET_DATA = os.path.join(ROOT, "get-data")
+DEFAULTS = {"projects": "10", "commits": "200", "files": "5",
+            "snapshots": "3", "latency": "0.05", "per-term": "0.001",
+            "max-terms": "0", "workers": "4", "repeat": "3"}
+CASES = ("snapshot", "snapshot-objects", "git", "files", "gerrit",
+         "batch-git", "batch-files", "batch-gerrit")
+
+
+def parse_options(argv):
+    options = dict(DEFAULTS)
+    args = []
+    for arg in argv:
+        if arg.startswith("--"):
+            key, _, value = arg[2:].partition("=")
+            options[key] = value
+        else:
+            args.append(arg)
+    return options, args
+
+
+def revision():
+    """Return the HEAD commit of the code under test, "+" if modified."""
+    def git(*args):
+        return subprocess.Popen(("git",) + args, cwd=ROOT,
+                                stdout=subprocess.PIPE).communicate()[0]
+    head = git("rev-parse", "--short", "HEAD").strip()
+    dirty = git("status", "--porcelain", "--untracked-files=no").strip()
+    return head + ("+" if dirty else "")
+
+
+def build_tree(options):
+    """Return (tree dir, manifests), reusing --work if built alike."""
+    sizes = [int(options[k]) for k in
+             ("projects", "commits", "files", "snapshots")]
+    tree = os.path.join(options["work"], "tree")
+    stamp = os.path.join(tree, "sizes")
+    if os.path.exists(stamp) and open(stamp).read() == repr(sizes):
+        mdir = os.path.join(tree, "manifests")
+        return tree, [os.path.join(mdir, f) for f in sorted(os.listdir(mdir))]
+    if os.path.exists(tree):
+        shutil.rmtree(tree)
+    t0 = time.time()
+    manifests = synth.make_tree(tree, *sizes)
+    with open(stamp, "w") as fp:
+        fp.write(repr(sizes))
+    print "tree: %d projects x %d commits in %.1fs" % (sizes[0], sizes[1],
+                                                       time.time() - t0)
+    return tree, manifests
+
+
+def case_args(case, tree, manifests, url, workers):
+    """Return the get-data arguments of a case."""
+    common = ["--workers=%d" % workers]
+    gerrit = ["--url=" + url, "--no-netrc"]
+    first_last = [tree, manifests[0], manifests[-1]]
+    return {
+        "snapshot": ["snapshot", tree] + manifests,
+        "snapshot-objects": ["snapshot", tree] + manifests +
+                            ["--no-checkout"],
+        "git": ["git"] + first_last + ["--summary"],
+        "files": ["files"] + first_last,
+        "gerrit": ["gerrit"] + first_last + gerrit,
+        "batch-git": ["batch", "git", tree] + manifests,
+        "batch-files": ["batch", "files", tree] + manifests,
+        "batch-gerrit": ["batch", "gerrit", tree] + manifests + gerrit,
+    }[case] + common
+
+
+def get_data(args, cwd):
+    """Run get-data in cwd; return (wall seconds, profile report)."""
+    profile = os.path.join(cwd, "profile.json")
+    with open(os.path.join(cwd, "stdout.log"), "a") as log:
+        t0 = time.time()
+        code = subprocess.call([sys.executable, GET_DATA] + args +
+                               ["--profile=" + profile], cwd=cwd,
+                               stdout=log, stderr=subprocess.STDOUT)
+        wall = time.time() - t0
+    if code != 0:
+        raise Exception("get-data %s failed, see %s/stdout.log" %
+                        (" ".join(args[:2]), cwd))
+    with open(profile) as fp:
+        return wall, json.load(fp)
+
+
+def run_case(case, args, work, repeat):
+    """Return {"cold": ..., "warm": ...} of a case."""
+    results = {}
+    for mode in ("cold", "warm"):
+        runs = []
+        for i in range(repeat):
+            cwd = tempfile.mkdtemp(dir=work)
+            try:
+                if mode == "cold":
+                    runs.append(get_data(args + ["--no-cache"], cwd))
+                else:
+                    extra = ["--cache-dir=" + os.path.join(cwd, "cache")]
+                    get_data(args + extra, cwd)
+                    runs.append(get_data(args + extra, cwd))
+            finally:
+                shutil.rmtree(cwd)
+        runs.sort(key=lambda r: r[0])
+        wall, profile = runs[len(runs) // 2]
+        results[mode] = {"runs": [r[0] for r in runs], "wall": wall,
+                         "cpu": profile["cpu"],
+                         "peak_rss_kb": profile["peak_rss_kb"],
+                         "stages": profile["stages"],
+                         "counters": profile["counters"]}
+        print "%-18s %-4s %7.2fs" % (case, mode, wall)
+    return results
+
+
+def run(options):
+    keep = "work" in options
+    work = os.path.abspath(options.get("work") or tempfile.mkdtemp())
+    options["work"] = work
+    if not os.path.isdir(work):
+        os.makedirs(work)
+    cases = options["cases"].split(",") if options.get("cases") else CASES
+    tree, manifests = build_tree(options)
+    S = StubGerrit(latency=float(options["latency"]),
+                   per_term=float(options["per-term"]),
+                   max_terms=int(options["max-terms"])).start()
+    report = {"revision": revision(),
+              "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "python": platform.python_version(),
+              "options": dict((k, options[k]) for k in DEFAULTS),
+              "cases": {}}
+    try:
+        for case in cases:
+            args = case_args(case, tree, manifests, S.url,
+                             int(options["workers"]))
+            report["cases"][case] = run_case(case, args, work,
+                                             int(options["repeat"]))
+    finally:
+        S.shutdown()
+        if not keep:
+            shutil.rmtree(work)
+    out = options.get("out") or "bench-%s.json" % report["revision"]
+    with open(out, "w") as fp:
+        json.dump(report, fp, indent=2, sort_keys=True)
+    print "report: %s" % out
+
+
+def ratio(old, new):
+    return "%6.2fx" % (old / new) if new else "     -"
+
+
+def compare(old_file, new_file):
+    """Print wall times and speedups of two reports, stage by stage."""
+    old = json.load(open(old_file))
+    new = json.load(open(new_file))
+    if old["options"] != new["options"]:
+        print "WARNING: the reports were made with different options"
+    print "%-34s %9s %9s %7s" % ("", old["revision"], new["revision"],
+                                 "speedup")
+    for case in sorted(set(old["cases"]) & set(new["cases"])):
+        for mode in ("cold", "warm"):
+            o = old["cases"][case][mode]
+            n = new["cases"][case][mode]
+            print "%-34s %8.2fs %8.2fs %s" % (case + " " + mode, o["wall"],
+                                               n["wall"],
+                                               ratio(o["wall"], n["wall"]))
+            for stage in sorted(set(o["stages"]) | set(n["stages"])):
+                ow = o["stages"].get(stage, {}).get("wall", 0.0)
+                nw = n["stages"].get(stage, {}).get("wall", 0.0)
+                print "  %-32s %8.2fs %8.2fs %s" % (stage, ow, nw,
+                                                    ratio(ow, nw))
+
+
+if __name__ == "__main__":
+    options, args = parse_options(sys.argv[1:])
+    if args[:1] == ["run"]:
+        run(options)
+    elif args[:1] == ["compare"] and len(args) == 3:
+        compare(args[1], args[2])
+    else:
+        raise Exception(__doc__)
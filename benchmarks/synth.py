@@ -0,0 +1,148 @@
+""" Generate synthetic multi-project git repositories and manifests.
+
+usage: python benchmarks/synth.py <dir> [projects] [commits] [files]
+                                        [snapshots]
+
+Creates <dir>/p000, <dir>/p001, ... with `commits` commits each on
+master, every 25th of them a merge, and <dir>/manifests/snap-NN.xml
+pinning every project at `snapshots` evenly spaced points of its
+history.  Commits are written with `git fast-import`, so large trees
+take seconds.  The same arguments always give the same repositories.
+"""
+
+import os
+import random
+import subprocess
+import sys
+
+EXTENSIONS = ('.java', '.java', '.c', '.h', '.cpp', '.mk', '.xml', '.txt')
+AUTHORS = ['dev%d@sony.com' % i for i in range(20)] + \
+          ['ext%d@example.com' % i for i in range(5)]
+EPOCH = 1451606400  # 2016-01-01
+MERGE_EVERY = 25
+
+
+def paths_of(rnd, n):
+    """Return n file paths spread over a few directories."""
+    paths = ["Makefile", "AndroidManifest.xml"]
+    while len(paths) < n:
+        paths.append("src/d%d/F%d%s" % (rnd.randrange(8), len(paths),
+                                        rnd.choice(EXTENSIONS)))
+    return paths
+
+
+def blob(text):
+    return "data %d\n%s\n" % (len(text), text)
+
+
+def commit(out, ref, mark, parent, author, date, message, changes,
+           merge=None):
+    out.append("commit %s\nmark :%d\n" % (ref, mark))
+    out.append("author %s <%s> %d +0000\n" % (author.split("@")[0], author,
+                                              date))
+    out.append("committer CI <ci@sony.com> %d +0000\n" % date)
+    out.append(blob(message))
+    if parent is not None:
+        out.append("from :%d\n" % parent)
+    if merge is not None:
+        out.append("merge :%d\n" % merge)
+    for path, text in changes:
+        out.append("M 100644 inline %s\n" % path)
+        out.append(blob(text))
+    out.append("\n")
+
+
+def project_stream(seed, commits, files):
+    """Return (fast-import stream, marks of the master commits)."""
+    rnd = random.Random(seed)
+    paths = paths_of(rnd, max(files * 4, 4))
+    lines = dict((p, 0) for p in paths)
+    out = []
+    masters = []
+    mark = 0
+    parent = None
+    for i in range(commits):
+        date = EPOCH + i * 3600 + rnd.randrange(3600)
+        changed = rnd.sample(paths, rnd.randint(1, files))
+        changes = []
+        for p in changed:
+            lines[p] = max(1, lines[p] + rnd.randint(-5, 40))
+            changes.append((p, "".join("line %d of %s\n" % (n, p)
+                                       for n in range(lines[p]))))
+        merge = None
+        if i and i % MERGE_EVERY == 0 and len(masters) > 2:
+            mark += 1
+            commit(out, "refs/heads/side", mark, masters[-2],
+                   rnd.choice(AUTHORS), date - 60, "Side change %d\n" % i,
+                   [("side/S%d.java" % i, "side\n")])
+            merge = mark
+        mark += 1
+        message = ("Merge side %d\n" % i if merge else
+                   "Change %d with \"quotes\"\n\nChange-Id: I%040x\n" %
+                   (i, rnd.getrandbits(160)))
+        commit(out, "refs/heads/master", mark, parent, rnd.choice(AUTHORS),
+               date, message, changes, merge)
+        masters.append(mark)
+        parent = mark
+    return "".join(out), masters
+
+
+def git(cwd, *args, **kwargs):
+    proc = subprocess.Popen(("git",) + args, cwd=cwd,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    out = proc.communicate(kwargs.get("input"))[0]
+    if proc.returncode != 0:
+        raise Exception("git %s failed in %s" % (args[0], cwd))
+    return out
+
+
+def make_project(path, seed, commits, files):
+    """Create the repository at path; return the SHAs of master, oldest
+    first."""
+    stream, masters = project_stream(seed, commits, files)
+    git(".", "init", "-q", path)
+    marks = os.path.join(path, ".git", "bench-marks")
+    git(path, "fast-import", "--quiet", "--export-marks=" + marks,
+        input=stream)
+    git(path, "reset", "-q", "--hard", "master")
+    shas = dict(line.split() for line in open(marks))
+    return [shas[":%d" % m] for m in masters]
+
+
+def write_manifest(filename, projects):
+    with open(filename, "w") as fp:
+        fp.write('<?xml version="1.0" encoding="UTF-8"?>\n<manifest>\n')
+        fp.write('  <remote name="origin" fetch=".."/>\n')
+        fp.write('  <default remote="origin" revision="master"/>\n')
+        for name, path, revision in projects:
+            fp.write('  <project name="%s" path="%s" revision="%s"/>\n' %
+                     (name, path, revision))
+        fp.write('</manifest>\n')
+
+
+def make_tree(root, projects=10, commits=200, files=5, snapshots=3):
+    """Create the repositories and manifests; return the manifest files."""
+    mdir = os.path.join(root, "manifests")
+    if not os.path.isdir(mdir):
+        os.makedirs(mdir)
+    history = []
+    for i in range(projects):
+        path = "p%03d" % i
+        shas = make_project(os.path.join(root, path), i, commits, files)
+        history.append(("platform/%s" % path, path, shas))
+    manifests = []
+    for k in range(snapshots):
+        at = (commits - 1) * k / max(snapshots - 1, 1)
+        filename = os.path.join(mdir, "snap-%02d.xml" % k)
+        write_manifest(filename, [(name, path, shas[at])
+                                  for name, path, shas in history])
+        manifests.append(filename)
+    return manifests
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        raise Exception(__doc__)
+    args = [int(x) for x in sys.argv[2:]]
+    for filename in make_tree(sys.argv[1], *args):
+        print filename
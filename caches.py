@@ -0,0 +1,201 @@
+""" On-disk caches shared by get-data runs."""
+
+import marshal
+import os
+import sqlite3
+import time
+import zlib
+
+from gitlog import LogCommit
+
+CACHE_DIR = "result-cache"
+# Default limit of the payloads of each cache file, in megabytes
+CACHE_MAX_MB = 1024
+
+
+class SqliteCache(object):
+
+    """Key/value table in SQLite with least-recently-used eviction.
+
+    Rows beyond `max_rows` or payload bytes beyond `max_bytes` are dropped,
+    oldest use first, down to 90% of the limit when evict() is called.
+    Payloads are zlib-compressed unless `compress` is off.
+    """
+
+    compress = True
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY, used INTEGER, payload BLOB);
+        CREATE INDEX IF NOT EXISTS cache_used ON cache (used);
+    """
+
+    def __init__(self, path, max_rows=None, max_bytes=None):
+        d = os.path.dirname(path)
+        if d and not os.path.isdir(d):
+            try:
+                os.makedirs(d)
+            except OSError:
+                pass  # created by a concurrent worker
+        self.path = path
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(path, timeout=600)
+        self.db.executescript(self.schema)
+
+    def get_many(self, keys, chunk=500):
+        """Return key -> payload for the keys found, marking them used."""
+        found = {}
+        for i in range(0, len(keys), chunk):
+            part = keys[i:i + chunk]
+            marks = ",".join("?" * len(part))
+            for key, payload in self.db.execute(
+                    "SELECT key, payload FROM cache WHERE key IN (%s)" % marks,
+                    part):
+                found[key] = self.compress and zlib.decompress(payload) or \
+                             str(payload)
+        if found:
+            keys = list(found)
+            now = int(time.time())
+            for i in range(0, len(keys), chunk):
+                part = keys[i:i + chunk]
+                self.db.execute("UPDATE cache SET used=? WHERE key IN (%s)" %
+                                ",".join("?" * len(part)), [now] + part)
+            self.db.commit()
+        return found
+
+    def put_many(self, items):
+        """Store (key, payload) pairs."""
+        now = int(time.time())
+        if self.compress:
+            items = ((key, zlib.compress(payload)) for key, payload in items)
+        self.db.executemany("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                            [(key, now, sqlite3.Binary(payload))
+                             for key, payload in items])
+        self.db.commit()
+
+    def evict(self):
+        """Drop least recently used rows until the limits are met."""
+        rows, size = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM cache"
+        ).fetchone()
+        drop = 0
+        if self.max_rows is not None and rows > self.max_rows:
+            drop = rows - int(self.max_rows * 0.9)
+        if self.max_bytes is not None and size > self.max_bytes:
+            drop = max(drop, int(rows * (1 - 0.9 * self.max_bytes / size)) + 1)
+        if drop:
+            self.db.execute("DELETE FROM cache WHERE key IN "
+                            "(SELECT key FROM cache ORDER BY used LIMIT ?)",
+                            (drop,))
+            self.db.commit()
+        return drop
+
+    def close(self):
+        self.db.close()
+
+
+class CommitCache(SqliteCache):
+
+    """Per-commit metadata and numstat keyed by SHA.
+
+    Commits never change, so an entry stays valid for as long as it is
+    kept; the repository path is not part of the key.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_rows=None, max_bytes=None):
+        super(CommitCache, self).__init__(os.path.join(cache_dir,
+                                                       "commits.sqlite"),
+                                          max_rows, max_bytes)
+        self.cache_dir = cache_dir
+
+    def get_many(self, repo_dir, shas):
+        """Return sha -> LogCommit for the shas found."""
+        found = super(CommitCache, self).get_many(shas)
+        return dict((sha, LogCommit(repo_dir, sha,
+                                    *marshal.loads(found[sha])))
+                    for sha in found)
+
+    def put_many(self, commits):
+        super(CommitCache, self).put_many((c.hexsha, marshal.dumps(c.state()))
+                                          for c in commits)
+
+    def __reduce__(self):
+        # Pool workers get their own connection to the same file
+        return (CommitCache, (self.cache_dir, self.max_rows, self.max_bytes))
+
+
+class BlobCache(SqliteCache):
+
+    """Line counts of git blobs keyed by blob SHA.
+
+    Lookups are memoized in memory as well, so snapshots measured by the
+    same process share them without going back to SQLite.
+    """
+
+    compress = False
+
+    def __init__(self, cache_dir=CACHE_DIR, max_rows=None, max_bytes=None):
+        super(BlobCache, self).__init__(os.path.join(cache_dir,
+                                                     "blobs.sqlite"),
+                                        max_rows, max_bytes)
+        self.cache_dir = cache_dir
+        self.memo = {}
+
+    def get_many(self, shas):
+        """Return sha -> number of lines for the shas found."""
+        found = dict((sha, self.memo[sha]) for sha in shas
+                     if sha in self.memo)
+        rest = [sha for sha in shas if sha not in found]
+        if rest:
+            stored = super(BlobCache, self).get_many(rest)
+            for sha in stored:
+                found[sha] = self.memo[sha] = int(stored[sha])
+        return found
+
+    def put_many(self, lines):
+        """Store a dict of sha -> number of lines."""
+        self.memo.update(lines)
+        super(BlobCache, self).put_many((sha, str(lines[sha]))
+                                        for sha in lines)
+
+    def __reduce__(self):
+        return (BlobCache, (self.cache_dir, self.max_rows, self.max_bytes))
+
+
+class ManifestCache(SqliteCache):
+
+    """Parsed repo manifests keyed by the SHA-1 of their XML text.
+
+    A manifest is kept as marshalled (name, path, revision) triples.
+    Lookups are memoized in memory for the rest of the process.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_rows=None, max_bytes=None):
+        super(ManifestCache, self).__init__(os.path.join(cache_dir,
+                                                         "manifests.sqlite"),
+                                            max_rows, max_bytes)
+        self.cache_dir = cache_dir
+        self.memo = {}
+
+    def get(self, digest):
+        """Return name -> {'path', 'revision'} of a manifest, or None."""
+        if digest not in self.memo:
+            found = super(ManifestCache, self).get_many([digest])
+            if digest not in found:
+                return None
+            self.memo[digest] = dict(
+                (name, {u'path': path, u'revision': revision})
+                for name, path, revision in marshal.loads(found[digest]))
+        return self.memo[digest]
+
+    def put(self, digest, projects):
+        self.memo[digest] = projects
+        triples = tuple((name, projects[name][u'path'],
+                         projects[name][u'revision']) for name in projects)
+        super(ManifestCache, self).put_many([(digest,
+                                              marshal.dumps(triples))])
+
+    def __reduce__(self):
+        return (ManifestCache, (self.cache_dir, self.max_rows,
+                                self.max_bytes))
@@ -0,0 +1,119 @@
+""" Progress of a get-data output kept on disk, for --resume.
+
+A checkpoint is a directory next to the output with a log of JSON lines:
+
+    {"info": {...}}                       settings of the run (file_base)
+    {"units": [...], "sizes": {...}}      units written, output file sizes
+    {"complete": true}                    every unit written
+
+Units are projects (git, files) or Gerrit query terms.  Output tables
+are CSV files appended to as units are done; on resume they are cut
+back to the sizes of the last logged line, which drops the rows of a
+unit that was being written when the run failed.  A line cut short by
+the failure is ignored.
+"""
+
+import cPickle as pickle
+import json
+import os
+import shutil
+
+import writers
+
+
+class Checkpoint(object):
+
+    """Units of one output already written, and their saved results.
+
+    Without `resume` any earlier checkpoint at path is dropped and info
+    is logged; with it the earlier log is read back and its info wins.
+    """
+
+    def __init__(self, path, resume=False, **info):
+        self.path = path
+        self.info = info
+        self.done = set()
+        self.data = {}
+        self.sizes = {}
+        self.complete = False
+        self.resumed = False
+        log = os.path.join(path, "log")
+        if resume and os.path.exists(log):
+            self.resumed = True
+            valid = 0
+            for line in open(log):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith("\n"):
+                    break
+                valid += len(line)
+                self.info.update(entry.get("info", {}))
+                self.done.update(entry.get("units", ()))
+                self.sizes.update(entry.get("sizes", {}))
+                if "data" in entry:
+                    self.data[entry["units"][0]] = entry["data"]
+                self.complete = entry.get("complete", self.complete)
+            with open(log, "a") as fp:
+                fp.truncate(valid)
+        elif os.path.exists(path):
+            shutil.rmtree(path)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.log = open(log, "a")
+        if not self.resumed:
+            self.write({"info": info})
+
+    def __contains__(self, unit):
+        return unit in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def write(self, entry):
+        self.log.write(json.dumps(entry) + "\n")
+        self.log.flush()
+
+    def open_table(self, filename, columns):
+        """Return a CSV table appending to filename from its logged size."""
+        size = self.sizes.get(filename, 0)
+        if size and (not os.path.exists(filename) or
+                     os.path.getsize(filename) < size):
+            raise Exception("Cannot resume: %s is shorter than checkpointed"
+                            % filename)
+        with open(filename, "a") as fp:
+            fp.truncate(size)
+        return writers.open_table(filename, columns, append=True)
+
+    def commit(self, units, tables, data=None):
+        """Log units as written once the tables are flushed.
+
+        data, the result of a single unit, is saved for load().
+        """
+        entry = {"units": list(units), "sizes": {}}
+        for t in tables:
+            t.flush()
+            entry["sizes"][t.path] = self.sizes[t.path] = t.size()
+        if data is not None:
+            n = len(self.data)
+            with open(os.path.join(self.path, "%d.pickle" % n), "wb") as fp:
+                pickle.dump(data, fp, pickle.HIGHEST_PROTOCOL)
+            entry["data"] = self.data[entry["units"][0]] = n
+        self.done.update(entry["units"])
+        self.write(entry)
+
+    def load(self, unit):
+        """Return the data committed with unit."""
+        with open(os.path.join(self.path, "%d.pickle" %
+                               self.data[unit]), "rb") as fp:
+            return pickle.load(fp)
+
+    def finish(self):
+        """Log the output as complete and drop the saved data."""
+        for n in self.data.values():
+            os.remove(os.path.join(self.path, "%d.pickle" % n))
+        self.data = {}
+        self.complete = True
+        self.write({"complete": True})
+        self.log.close()
@@ -0,0 +1,190 @@
+""" Keep raw Gerrit change JSON on disk between runs."""
+
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+CLOSED = ('MERGED', 'ABANDONED')
+# Seconds a SHA Gerrit had no change for is not asked for again
+MISS_TTL = 24 * 3600
+
+
+class ChangeCache(object):
+
+    """SQLite store of change payloads keyed by change number.
+
+    Each change is stored zlib-compressed together with its `updated`
+    field and the SHAs of all its revisions, so a commit SHA can be
+    resolved to a cached change without asking Gerrit.  Closed changes
+    (merged or abandoned) are considered final; open ones are stale.
+    SHAs that Gerrit was asked for and had no change for are kept as
+    misses, with the time they were recorded, and not asked for again
+    for `miss_ttl` seconds: the commit may not be uploaded or indexed
+    yet.
+    """
+
+    def __init__(self, path="result-gerrit/changes.sqlite",
+                 miss_ttl=MISS_TTL):
+        d = os.path.dirname(path)
+        if d and not os.path.isdir(d):
+            os.makedirs(d)
+        self.path = path
+        self.miss_ttl = miss_ttl
+        self.db = sqlite3.connect(path)
+        columns = [row[1] for row in
+                   self.db.execute("PRAGMA table_info(sync)")]
+        if columns and "status" not in columns:
+            # Marks of older caches may come from filtered syncs
+            self.db.execute("DROP TABLE sync")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS changes (
+                number INTEGER PRIMARY KEY,
+                project TEXT, branch TEXT, status TEXT, updated TEXT,
+                payload BLOB);
+            CREATE TABLE IF NOT EXISTS revisions (
+                sha TEXT PRIMARY KEY, number INTEGER);
+            CREATE TABLE IF NOT EXISTS misses (
+                sha TEXT PRIMARY KEY, recorded INTEGER);
+            CREATE INDEX IF NOT EXISTS changes_branch
+                ON changes (project, branch);
+            CREATE TABLE IF NOT EXISTS sync (
+                project TEXT, branch TEXT, status TEXT, updated TEXT,
+                PRIMARY KEY (project, branch, status));
+        """)
+        columns = [row[1] for row in
+                   self.db.execute("PRAGMA table_info(misses)")]
+        if "recorded" not in columns:
+            # Misses of older caches have no time: ask for them again
+            self.db.execute("ALTER TABLE misses ADD COLUMN recorded INTEGER "
+                            "DEFAULT 0")
+            self.db.commit()
+
+    def put(self, data):
+        """Store changes that are new or whose `updated` has moved.
+
+        Return the changes as they read back from the cache.  Payloads are
+        dumped with sorted keys, so fresh and cached changes iterate their
+        dicts (revisions, files) in the same order when exported.
+        """
+        stored = []
+        for c in data:
+            payload = json.dumps(c, sort_keys=True)
+            stored.append(json.loads(payload))
+            row = self.db.execute("SELECT updated FROM changes WHERE number=?",
+                                  (c['_number'],)).fetchone()
+            if row is not None and row[0] == c.get('updated'):
+                continue
+            self.db.execute("INSERT OR REPLACE INTO changes VALUES "
+                            "(?, ?, ?, ?, ?, ?)",
+                            (c['_number'], c['project'], c['branch'],
+                             c.get('status'), c.get('updated'),
+                             sqlite3.Binary(zlib.compress(payload))))
+            self.db.executemany("INSERT OR REPLACE INTO revisions VALUES (?, ?)",
+                                [(sha, c['_number'])
+                                 for sha in c.get('revisions', {})])
+        self.db.commit()
+        return stored
+
+    def put_misses(self, terms, data):
+        """Record the SHAs among query terms that no change in data has.
+
+        Only data of queries with all of gerrit.QUERY_OPTIONS tells
+        misses apart: other answers may lack the revisions looked for.
+        Return the number of misses recorded.
+        """
+        found = set()
+        for c in data:
+            found.update(c.get('revisions', {}))
+        now = int(time.time())
+        misses = [(t, now) for t in terms
+                  if len(str(t)) == 40 and t not in found]
+        self.db.executemany("INSERT OR REPLACE INTO misses VALUES (?, ?)",
+                            misses)
+        self.db.commit()
+        return len(misses)
+
+    def get(self, number):
+        """Return the cached change number, or None."""
+        row = self.db.execute("SELECT payload FROM changes WHERE number=?",
+                              (number,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def get_many(self, numbers, chunk=500):
+        """Return the cached changes of numbers, in that order."""
+        payloads = {}
+        for i in range(0, len(numbers), chunk):
+            part = numbers[i:i + chunk]
+            payloads.update(self.db.execute(
+                "SELECT number, payload FROM changes WHERE number IN (%s)" %
+                ",".join("?" * len(part)), part))
+        return [json.loads(zlib.decompress(payloads[number]))
+                for number in numbers]
+
+    def split(self, shas, stale_ok=False):
+        """Return (cached numbers, terms still to query, SHAs) for shas.
+
+        Cached changes are listed once by number, in order of their first
+        SHA; get_many() reads them.  Open changes are queried again by
+        change number, once, unless stale_ok is set; unknown SHAs are
+        queried as they are and misses recorded less than miss_ttl
+        seconds ago are dropped.  SHAs maps the number of every change
+        found, cached or to query again, to the SHAs it was found by.
+        """
+        cached = []
+        missing = []
+        found = {}
+        since = int(time.time()) - self.miss_ttl
+        for sha in shas:
+            row = self.db.execute(
+                "SELECT c.number, c.status FROM revisions r "
+                "JOIN changes c ON c.number = r.number WHERE r.sha=?",
+                (sha,)).fetchone()
+            if row is None:
+                if self.db.execute("SELECT 1 FROM misses WHERE sha=? "
+                                   "AND recorded>?",
+                                   (sha, since)).fetchone() is None:
+                    missing.append(sha)
+            elif row[0] in found:
+                found[row[0]].append(sha)
+            else:
+                found[row[0]] = [sha]
+                if stale_ok or row[1] in CLOSED:
+                    cached.append(row[0])
+                else:
+                    missing.append(row[0])
+        return cached, missing, found
+
+    def iter_changes(self, project=None, branch=None):
+        """Yield cached changes by number, optionally of one branch."""
+        query = "SELECT payload FROM changes"
+        args = ()
+        if project is not None:
+            query += " WHERE project=? AND branch=?"
+            args = (project, branch)
+        for row in self.db.execute(query + " ORDER BY number", args):
+            yield json.loads(zlib.decompress(row[0]))
+
+    def mark(self, project, branch, status=None):
+        """Return the `updated` last synced for a branch, or None.
+
+        Syncs filtered by status keep marks of their own: a change left
+        out by one filter is still to be fetched by the others.
+        """
+        row = self.db.execute("SELECT updated FROM sync WHERE project=? "
+                              "AND branch=? AND status=?",
+                              (project, branch,
+                               (status or "").lower())).fetchone()
+        return row and row[0]
+
+    def set_mark(self, project, branch, updated, status=None):
+        """Record the high-water mark of a branch synced with status."""
+        self.db.execute("INSERT OR REPLACE INTO sync VALUES (?, ?, ?, ?)",
+                        (project, branch, (status or "").lower(), updated))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
@@ -1,12 +1,22 @@
 """ Get data from Gerrit and export it to CSV."""
 
+from collections import deque
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
 from pygerrit.rest import auth
 from pygerrit import rest
-from requests.exceptions import HTTPError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError, RequestException
+import json
 import re
-import csv
 import os
+import requests
+import threading
+import time
+
+import profiling
+import shards
+import writers
 
 SOMCGR = "http://review.sonyericsson.net"
 REVMSG_ABANDONED = "Abandoned"
@@ -18,6 +28,11 @@ REVMSG_REVERTED = "Reverted\n\nThis patchset was reverted in change: "
 REVMSG_UPLOADED = 'Uploaded patch set %d.'
 COMMSG_CHERRY = "(cherry picked from commit "
 COMMSG_REVERT = "This reverts commit "
+QUERY_OPTIONS = "&o=ALL_REVISIONS&o=ALL_COMMITS&o=ALL_FILES&o=MESSAGES"
+# Bytes read from the network at a time while parsing an answer
+CHUNK_SIZE = 65536
+# Answers meaning "query too long": split the batch and try again
+SPLIT_STATUS = (400, 414)
 
 
 def rm_slashes(string):
@@ -34,12 +49,142 @@ def rm_quotes(string):
     return re.sub(string=string, pattern='"', repl='``')
 
 
+def iter_json_array(chunks):
+    """Yield the items of a JSON array whose text comes in chunks.
+
+    Gerrit's magic prefix is skipped.  Items are decoded as soon as
+    they are complete, so the whole text is never held at once.  An
+    incomplete item, or a number the text so far may cut short, is
+    tried again once the text has doubled, which keeps the work linear
+    in the size of the text.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ""
+    pending = []
+    size = 0
+    want = len(rest.GERRIT_MAGIC_JSON_PREFIX) + 1
+    state = "prefix"
+    eof = False
+    while state != "done":
+        for chunk in chunks:
+            pending.append(chunk)
+            size += len(chunk)
+            if len(buf) + size >= want:
+                break
+        else:
+            eof = True
+        buf += "".join(pending)
+        pending = []
+        size = 0
+        pos = 0
+        if state == "prefix":
+            if buf.startswith(rest.GERRIT_MAGIC_JSON_PREFIX):
+                pos = len(rest.GERRIT_MAGIC_JSON_PREFIX)
+            state = "open"
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos == len(buf):
+                break
+            if state == "open":
+                if buf[pos] != "[":
+                    raise ValueError("Not a JSON array: %r" %
+                                     buf[pos:pos + 80])
+                pos += 1
+                state = "first"
+            elif state in ("first", "item"):
+                if state == "first" and buf[pos] == "]":
+                    state = "done"
+                    break
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    if eof:
+                        raise
+                    break
+                number = isinstance(item, (int, long, float)) and \
+                    not isinstance(item, bool)
+                if number and not eof and \
+                        (end == len(buf) or buf[end] in "0123456789.eE+-"):
+                    break  # the number may go on in the next chunk
+                pos = end
+                state = "next"
+                yield item
+            elif buf[pos] == ",":
+                pos += 1
+                state = "item"
+            elif buf[pos] == "]":
+                state = "done"
+                break
+            else:
+                raise ValueError("Bad JSON array at %r" % buf[pos:pos + 80])
+        buf = buf[pos:]
+        want = 2 * len(buf) or 1
+        if eof and state != "done":
+            raise ValueError("Truncated JSON array")
+
+
+class PooledRestAPI(rest.GerritRestAPI):
+
+    """GerritRestAPI sending all requests through one pooled session.
+
+    Answers come gzip-compressed (pygerrit asks for it) and are parsed
+    while they arrive; all endpoints used here answer with arrays.
+    """
+
+    def __init__(self, url, auth=None, verify=True, pool_size=10):
+        super(PooledRestAPI, self).__init__(url, auth=auth, verify=verify)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, endpoint, **kwargs):
+        """Send HTTP GET to the endpoint and return decoded JSON.
+
+        Every request is timed and counted, failed ones (rejected, 5xx,
+        unreachable) as "gerrit errors" as well.
+        """
+        kwargs.update(self.kwargs.copy())
+        start = time.time()
+        try:
+            response = self.session.get(self.make_url(endpoint),
+                                        stream=True, **kwargs)
+            try:
+                response.raise_for_status()
+                data = list(iter_json_array(
+                    response.iter_content(CHUNK_SIZE)))
+                profiling.count("gerrit bytes", response.raw.tell())
+            finally:
+                response.close()
+        except Exception:
+            profiling.count("gerrit errors")
+            raise
+        finally:
+            profiling.observe("gerrit http", time.time() - start)
+            profiling.count("gerrit requests")
+        return data
+
+
+def connect(url=SOMCGR, netrc=True, pool_size=10):
+    """Return a PooledRestAPI, authenticated from ~/.netrc if netrc."""
+    a = None
+    if netrc:
+        a = auth.HTTPDigestAuthFromNetrc(url)
+    return PooledRestAPI(url, verify=False, auth=a, pool_size=pool_size)
+
+
 class Base(object):
 
-    """Class to hold basic query input data."""
+    """Class to hold basic query input data.
+
+    options are the "&o=..." query options, see query_options().
+    """
 
     def __init__(self, project=None, branch=None, numbers=None, \
-                 dst=None, url=SOMCGR):
+                 dst=None, url=SOMCGR, req=None, options=QUERY_OPTIONS):
         if (numbers is not None and project is None and branch is None):
             pass
         elif (numbers is None and project is not None and branch is not None):
@@ -49,6 +194,7 @@ class Base(object):
         self.project = project
         self.branch = branch
         self.numbers = numbers
+        self.options = options
 
         if dst is not None:
             self.dst = dst
@@ -59,30 +205,63 @@ class Base(object):
             os.makedirs(self.dst)
         except OSError:
             pass #raise Exception("Default path %s already exists." % project)
-        self.a = auth.HTTPDigestAuthFromNetrc(url)
-        self.req = rest.GerritRestAPI(url, verify=False, auth=self.a)
+        if req is not None:
+            # Share an existing (pooled) session instead of a new login
+            self.a = req.kwargs['auth']
+            self.req = req
+        else:
+            self.a = auth.HTTPDigestAuthFromNetrc(url)
+            self.req = rest.GerritRestAPI(url, verify=False, auth=self.a)
+
+
+def changes_query(base, status=None, since=None):
+    """Return the changes/ query of a Base, its branch or its numbers."""
+    if base.numbers is None:
+        query = "changes/?q=project:%s+branch:%s" % (base.project, base.branch)
+        if status is not None:
+            query += "+status:%s" % status
+        if since is not None:
+            # Gerrit timestamps carry nanoseconds, after: wants seconds
+            query += "+after:%%22%s%%22" % "+".join(since[:19].split(" "))
+    else:
+        numbers = [str(x) for x in base.numbers]
+        query = "changes/?q=%s" % ("+OR+".join(numbers))
+    return query + base.options
+
+
+def iter_pages(req, query):
+    """Yield the pages of changes Gerrit answers query with.
+
+    Gerrit caps the result size and flags the last change of a truncated
+    page with _more_changes; the next page continues from there.
+    """
+    start = 0
+    while True:
+        page = req.get(query + "&S=%d" % start)
+        yield page
+        start += len(page)
+        if not page or not page[-1].get('_more_changes'):
+            break
 
 
 class Changes(object):
 
     """Class to encapsulate data collected from change endpoints."""
 
-    def __init__(self, base, status=None, file_base = None):
+    def __init__(self, base, status=None, file_base = None, data=None,
+                 since=None):
         self.base = base
         self.status = status
         if file_base is None:
             file_base = datetime.now().strftime('%Y-%m%d-%H%M-%S')
         self.file_base = file_base
-        if base.numbers is None:
-            query = "changes/?q=project:%s+branch:%s" % (base.project, base.branch)
-            if status is not None:
-                query += "+status:%s" % status
-        else:
-            numbers = [str(x) for x in base.numbers]
-            query = "changes/?q=%s" % ("+OR+".join(numbers))
-        query += "&o=ALL_REVISIONS&o=ALL_COMMITS&o=ALL_FILES&o=MESSAGES"
-
-	self.data = base.req.get(query)
+        if data is not None:
+            # Already known (e.g. from a ChangeCache), nothing to query
+            self.data = data
+            return
+        self.data = []
+        for page in iter_pages(base.req, changes_query(base, status, since)):
+            self.data += page
 
     def merge(self, changes):
         """Merge another Changes instance."""
@@ -90,176 +269,465 @@ class Changes(object):
             raise Exception("wrong input")
         self.data += changes.data
 
+    def export(self, tables=None, fmt='csv'):
+        """Export Changes data, one file per table."""
+        E = Export(self.base.dst, self.file_base, tables, fmt)
+        try:
+            E.write(self.data)
+        finally:
+            E.close()
+
     def changes_csv(self):
         """Export Changes data in CSV."""
-        filename = self.file_base + "-changes.csv"
-        path = os.path.join(self.base.dst, filename)
-        with open(path, 'w') as fp:
-            a = csv.writer(fp)
-            a.writerow(('number', 'change_id', 'current_revision',
-                        'project', 'branch',
-                        'num_patches', 'date_created',
-                        'date_closed', 'closed_by', 'created_by',
-                        'reverted_by'))
-            for c in self.data:
-                try:
-                    current_revision = c['current_revision']
-                except KeyError:
-                    current_revision = c['revisions'].keys()[-1]
-                details = c['revisions'][current_revision]
-                closed_by = ''
-                date_closed = ''
-                reverted_by = ''
-                review_messages = c['messages']
-                for msg in review_messages:
-                    if REVMSG_ABANDONED in msg['message']:
-                        closed_by = 'abandoned'
-                        date_closed = msg['date']
-                        break
-                    elif REVMSG_MERGED in msg['message']:
-                        closed_by = 'merged'
-                        date_closed = msg['date']
-                        break
-                    elif REVMSG_PUSHED in msg['message']:
-                        closed_by = 'pushed'
-                        date_closed = msg['date']
-                        break
-
-                for msg in review_messages:
-                    if REVMSG_REVERTED in msg['message']:
-                        revert_id = re.match('(.*)\n\n.*(I[a-f0-9]{40}$)',
-                                            msg['message']).groups()[1]
-                        reverted_by = revert_id
-                        break
-
-                created_by = ''
-                commit_message = details['commit']['message']
-                if COMMSG_CHERRY in commit_message:
-                    created_by = 'cherry-pick'
-                elif COMMSG_REVERT in commit_message:
-                    created_by = 'revert'
-
-                row = (c['_number'], c['change_id'], current_revision,
-                       c['project'], c['branch'],
-                       details['_number'], c['created'],
-                       date_closed, closed_by, created_by,
-                       reverted_by)
-                try:
-                    a.writerow(row)
-                except UnicodeEncodeError: # e.g. 932240
-                    pass
+        self.export(('changes',))
 
     def patchsets_csv(self):
         """Export Patch Sets data in CSV."""
-        filename = self.file_base + "-patchsets.csv"
-        path = os.path.join(self.base.dst, filename)
-        with open(path, 'w') as fp:
-            a = csv.writer(fp)
-            a.writerow(('number', 'revision_number',
-                        'revision', 'committer',
-                        'date_commit', 'date_upload', 'message'))
-            for c in self.data:
-                number = c['_number']
-                revisions = c['revisions'].keys()
-                for revision in revisions:
-                    p = c['revisions'][revision]
-                    revision_number = p['_number']
-                    details = p['commit']['committer']
-                    committer = details['email']
-                    date_commit = details['date']
-                    message = rm_quotes(p['commit']['message'])
-                    # In CSV, quotes '"' in `message` causes problems
-                    message = unicode(message).encode("utf-8")
-                    review_messages = c['messages']
-                    date_upload = ''
-                    for rmessage in review_messages:
-                        if rmessage['message'] == \
-                        REVMSG_UPLOADED % revision_number:
-                            date_upload = rmessage['date']
-                            break
-                        if rmessage['message'] == \
-                        REVMSG_UPDATE_MSG % revision_number:
-                            date_upload = rmessage['date']
-                            break
-                        if rmessage['message'] == \
-                        REVMSG_REBASED % (revision_number, revision_number - 1):
-                            date_upload = rmessage['date']
-                            break
-                    row = (number, revision_number,
-                                revision, committer,
-                                date_commit, date_upload, message)
-                    try:
-                        a.writerow(row)
-                    except UnicodeEncodeError: # e.g. 932240
-                        pass
+        self.export(('patchsets',))
 
     def reviews_csv(self):
         """Export Review data in CSV."""
-        filename = self.file_base + "-reviews.csv"
-        path = os.path.join(self.base.dst, filename)
-        with open(path, 'w') as fp:
-            a = csv.writer(fp)
-            a.writerow(('number', 'revision_number',
-                        'reviewer', 'date',
-                        'message'))
-            for c in self.data:
-                number = c['_number']
-                reviews = c['messages']
-                for review in reviews:
-                    revision_number = review['_revision_number']
-                    #TODO: Sometimes _revision_number does not exist like #125
-                    if 'author' in review:
-                        reviewer = review['author']['name']
-                        reviewer = unicode(reviewer).encode("utf-8")
-                    else:
-                        reviewer = "Gerrit Code Review"
-                    date = review['date']
-                    message = rm_quotes(review['message'])
-                    # In CSV, quotes '"' in `message` causes problems
-                    try:
-                        row = (number, revision_number,
-                               reviewer, date,
-                               message)
-                        a.writerow(row)
-                    except UnicodeEncodeError:
-                        print reviewer
+        self.export(('reviews',))
 
     def files_csv(self):
         """Export File data in CSV."""
-        filename = self.file_base + "-files.csv"
-        path = os.path.join(self.base.dst, filename)
-        with open(path, 'w') as fp:
-            a = csv.writer(fp)
-            a.writerow(('number', 'revision_number',
-                        'file', 'status',
-                        'lines_add', 'lines_del'))
-            for c in self.data:
-                number = c['_number']
-                revisions = c['revisions'].keys()
-                for revision in revisions:
-                    p = c['revisions'][revision]
-                    revision_number = p['_number']
-                    file_details = p['files']
-                    file_names = file_details.keys()
-                    for fname in file_names:
-                        name = fname
-                        detail = file_details[name]
-                        lines_add = 0
-                        lines_del = 0
-                        status = ''
-                        if 'lines_inserted' in detail:
-                            lines_add = int(detail['lines_inserted'])
-                        if 'lines_deleted' in detail:
-                            lines_del = int(detail['lines_deleted'])
-                        if 'status' in detail:
-                            status = detail['status']
-                        row = (number, revision_number,
-                               name, status,
-                               lines_add, lines_del)
-                        try:
-                            a.writerow(row)
-                        except UnicodeEncodeError: # e.g. 932240
-                            pass
+        self.export(('files',))
+
+
+# Review messages announcing a new patch set; the first one found for a
+# revision dates its upload (REVMSG_UPLOADED, _UPDATE_MSG and _REBASED).
+REVMSG_UPLOAD_RE = re.compile(
+    r"(?:Uploaded patch set (?P<uploaded>0|[1-9][0-9]*)\."
+    r"|Patch Set (?P<number>0|[1-9][0-9]*): "
+    r"(?:Commit message was updated"
+    r"|Patch Set (?P<rebased>-?(?:0|[1-9][0-9]*)) was rebased))\Z")
+
+
+def index_messages(c):
+    """Classify the review messages of change c in one pass.
+
+    Return a dict with 'uploaded' (revision number -> upload date),
+    'closed_by' and 'date_closed' (first abandon/merge/push message) and
+    'reverted_by' (Change-Id of the first revert).
+    """
+    index = {'uploaded': {}, 'closed_by': '', 'date_closed': '',
+             'reverted_by': ''}
+    uploaded = index['uploaded']
+    for msg in c.get('messages', ()):
+        text = msg['message']
+        if not index['closed_by']:
+            if REVMSG_ABANDONED in text:
+                index['closed_by'] = 'abandoned'
+                index['date_closed'] = msg['date']
+            elif REVMSG_MERGED in text:
+                index['closed_by'] = 'merged'
+                index['date_closed'] = msg['date']
+            elif REVMSG_PUSHED in text:
+                index['closed_by'] = 'pushed'
+                index['date_closed'] = msg['date']
+        if not index['reverted_by'] and REVMSG_REVERTED in text:
+            index['reverted_by'] = re.match('(.*)\n\n.*(I[a-f0-9]{40}$)',
+                                            text).groups()[1]
+        m = REVMSG_UPLOAD_RE.match(text)
+        if m is None:
+            continue
+        if m.group('uploaded') is not None:
+            number = int(m.group('uploaded'))
+        else:
+            number = int(m.group('number'))
+            rebased = m.group('rebased')
+            if rebased is not None and int(rebased) != number - 1:
+                continue
+        if number not in uploaded:
+            uploaded[number] = msg['date']
+    return index
+
+
+def change_rows(c, index=None):
+    """Yield the row of change c for the changes table."""
+    if index is None:
+        index = index_messages(c)
+    try:
+        current_revision = c['current_revision']
+    except KeyError:
+        current_revision = c['revisions'].keys()[-1]
+    details = c['revisions'][current_revision]
+
+    created_by = ''
+    commit_message = details['commit']['message']
+    if COMMSG_CHERRY in commit_message:
+        created_by = 'cherry-pick'
+    elif COMMSG_REVERT in commit_message:
+        created_by = 'revert'
+
+    yield (c['_number'], c['change_id'], current_revision,
+           c['project'], c['branch'],
+           details['_number'], c['created'],
+           index['date_closed'], index['closed_by'], created_by,
+           index['reverted_by'])
+
+
+def patchset_rows(c, index=None):
+    """Yield one row per revision of change c for the patchsets table."""
+    if index is None:
+        index = index_messages(c)
+    number = c['_number']
+    revisions = c['revisions'].keys()
+    for revision in revisions:
+        p = c['revisions'][revision]
+        revision_number = p['_number']
+        details = p['commit']['committer']
+        committer = details['email']
+        date_commit = details['date']
+        date_upload = index['uploaded'].get(revision_number, '')
+        yield (number, revision_number,
+               revision, committer,
+               date_commit, date_upload, p['commit']['message'])
+
+
+def review_rows(c, index=None):
+    """Yield one row per review message of change c for the reviews table."""
+    number = c['_number']
+    reviews = c['messages']
+    for review in reviews:
+        revision_number = review['_revision_number']
+        #TODO: Sometimes _revision_number does not exist like #125
+        if 'author' in review:
+            reviewer = review['author']['name']
+        else:
+            reviewer = "Gerrit Code Review"
+        date = review['date']
+        yield (number, revision_number,
+               reviewer, date,
+               review['message'])
+
+
+def file_rows(c, index=None):
+    """Yield one row per file and revision of change c for the files table."""
+    number = c['_number']
+    revisions = c['revisions'].keys()
+    for revision in revisions:
+        p = c['revisions'][revision]
+        revision_number = p['_number']
+        file_details = p['files']
+        file_names = file_details.keys()
+        for fname in file_names:
+            name = fname
+            detail = file_details[name]
+            lines_add = 0
+            lines_del = 0
+            status = ''
+            if 'lines_inserted' in detail:
+                lines_add = int(detail['lines_inserted'])
+            if 'lines_deleted' in detail:
+                lines_del = int(detail['lines_deleted'])
+            if 'status' in detail:
+                status = detail['status']
+            yield (number, revision_number,
+                   name, status,
+                   lines_add, lines_del)
+
+
+TABLES = ('changes', 'patchsets', 'reviews', 'files')
+# Column kinds are described in writers; 'text' columns get rm_quotes'd
+# in CSV, where quotes '"' in messages cause problems.
+TABLE_COLUMNS = {
+    'changes': (('number', 'int'), ('change_id', 'str'),
+                ('current_revision', 'str'),
+                ('project', 'category'), ('branch', 'category'),
+                ('num_patches', 'int'), ('date_created', 'gerrit_time'),
+                ('date_closed', 'gerrit_time'), ('closed_by', 'category'),
+                ('created_by', 'category'),
+                ('reverted_by', 'str')),
+    'patchsets': (('number', 'int'), ('revision_number', 'int'),
+                  ('revision', 'str'), ('committer', 'category'),
+                  ('date_commit', 'gerrit_time'),
+                  ('date_upload', 'gerrit_time'), ('message', 'text')),
+    'reviews': (('number', 'int'), ('revision_number', 'int'),
+                ('reviewer', 'category'), ('date', 'gerrit_time'),
+                ('message', 'text')),
+    'files': (('number', 'int'), ('revision_number', 'int'),
+              ('file', 'str'), ('status', 'category'),
+              ('lines_add', 'int'), ('lines_del', 'int')),
+}
+TABLE_ROWS = {
+    'changes': change_rows,
+    'patchsets': patchset_rows,
+    'reviews': review_rows,
+    'files': file_rows,
+}
+# Query options ("o=") the rows of each table are made from
+TABLE_OPTIONS = {
+    'changes': ('CURRENT_REVISION', 'CURRENT_COMMIT', 'MESSAGES'),
+    'patchsets': ('ALL_REVISIONS', 'ALL_COMMITS', 'MESSAGES'),
+    'reviews': ('MESSAGES',),
+    'files': ('ALL_REVISIONS', 'ALL_FILES'),
+}
+OPTIONS = ('CURRENT_REVISION', 'ALL_REVISIONS', 'CURRENT_COMMIT',
+           'ALL_COMMITS', 'CURRENT_FILES', 'ALL_FILES', 'MESSAGES')
+# (current, all): the second includes the first
+OPTION_PAIRS = (('CURRENT_REVISION', 'ALL_REVISIONS'),
+                ('CURRENT_COMMIT', 'ALL_COMMITS'),
+                ('CURRENT_FILES', 'ALL_FILES'))
+
+
+def query_options(tables=None):
+    """Return the "&o=..." options Gerrit needs for tables, all by default.
+
+    They are QUERY_OPTIONS for all tables; fewer tables ask for less,
+    e.g. only the current revision for the changes table.
+    """
+    if tables is None:
+        tables = TABLES
+    wanted = set()
+    for table in tables:
+        wanted.update(TABLE_OPTIONS[table])
+    for current, every in OPTION_PAIRS:
+        if every in wanted:
+            wanted.discard(current)
+    return "".join("&o=" + o for o in OPTIONS if o in wanted)
+
+
+class Export(object):
+
+    """Write the tables of changes in one pass, as they arrive.
+
+    fmt is one of writers.FORMATS; each table goes to
+    <dst>/<file_base>-<table>.<fmt>.  With a Checkpoint the CSV tables
+    are appended to from where it left them.  With a shards.Shard they
+    are the shard's part of those files, written under <dst>/shard-I-of-N.
+    """
+
+    def __init__(self, dst="result-gerrit", file_base=None, tables=None,
+                 fmt='csv', checkpoint=None, shard=None):
+        if file_base is None:
+            file_base = datetime.now().strftime('%Y-%m%d-%H%M-%S')
+        if tables is None:
+            tables = TABLES
+        self.file_base = file_base
+        self.tables = tables
+        self.count = 0
+        try:
+            os.makedirs(dst)
+        except OSError:
+            pass
+        self.writers = []
+        for table in tables:
+            path = os.path.join(dst, "%s-%s.csv" % (file_base, table))
+            if checkpoint is not None:
+                a = checkpoint.open_table(path, TABLE_COLUMNS[table])
+            elif shard is not None:
+                # One part: shards follow each other in SHA order
+                a = shards.ShardTable(path, TABLE_COLUMNS[table], fmt, shard,
+                                      split="sha-range")
+                a.part([shard.index])
+            else:
+                a = writers.open_table(path, TABLE_COLUMNS[table], fmt)
+            self.writers.append((table, a))
+
+    def write(self, data):
+        """Append the rows of all changes in data to every table."""
+        with profiling.stage("write"):
+            for c in data:
+                index = index_messages(c)
+                for table, a in self.writers:
+                    a.writerows(TABLE_ROWS[table](c, index))
+                self.count += 1
+
+    def options(self):
+        """Return the query options the tables need."""
+        return query_options(self.tables)
+
+    def outputs(self):
+        """Return the table writers."""
+        return [a for table, a in self.writers]
+
+    def close(self):
+        for table, a in self.writers:
+            a.close()
+
+
+def fetch(base, file_base=None, retries=3, delay=1.0):
+    """Return Changes of base, retrying failed requests."""
+    for attempt in range(retries + 1):
+        try:
+            return Changes(base, file_base=file_base)
+        except RequestException as e:
+            # Client errors (4xx) will not get better by asking again
+            if isinstance(e, HTTPError) and e.response is not None and \
+               e.response.status_code < 500:
+                raise
+            if attempt == retries:
+                raise GerritAccessError("%s (after %d retries)" % (e, retries))
+            time.sleep(delay * 2 ** attempt)
+
+
+class BatchSizer(object):
+
+    """Choose how many numbers go into each query.
+
+    A query URL never exceeds `max_url` bytes.  Within that, the batch
+    doubles while Gerrit answers in less than half of `target` seconds
+    and shrinks in proportion when it takes longer than `target`.  A
+    batch rejected as too long (SPLIT_STATUS) caps all later ones below
+    its size.
+    """
+
+    def __init__(self, req, nmax=75, max_url=8000, target=2.0,
+                 options=QUERY_OPTIONS):
+        self.size = nmax
+        self.limit = None
+        self.max_url = max_url
+        self.target = target
+        # Everything in the URL but the terms; S= allows 7 digits
+        self.overhead = len(req.make_url("changes/?q=") + options +
+                            "&S=0000000")
+        self.lock = threading.Lock()
+
+    def take(self, numbers, i):
+        """Return the end of the batch starting at numbers[i]."""
+        budget = self.max_url - self.overhead
+        j = i
+        length = 0
+        while j < len(numbers) and j - i < self.size:
+            length += len(str(numbers[j])) + (j > i and len("+OR+"))
+            if length > budget and j > i:
+                break
+            j += 1
+        return j
+
+    def record(self, n, seconds):
+        """Adapt the size to a batch of n numbers answered in seconds."""
+        with self.lock:
+            if seconds > self.target:
+                self.size = max(1, int(n * self.target / seconds))
+            elif seconds < self.target / 2 and n >= self.size:
+                self.size *= 2
+            if self.limit is not None:
+                self.size = min(self.size, self.limit)
+
+    def reject(self, n):
+        """Note that a batch of n numbers was refused as too long."""
+        with self.lock:
+            self.limit = max(1, n / 2)
+            self.size = min(self.size, self.limit)
+
+
+def fetch_batch(base, file_base=None, retries=3, sizer=None):
+    """Return fetch() of base, halving it while Gerrit finds it too long.
+
+    Answers for the halves are merged back into one Changes of base.
+    With a BatchSizer, its size follows the time each answer took.
+    """
+    start = time.time()
+    try:
+        with profiling.stage("gerrit fetch"):
+            changes = fetch(base, file_base, retries)
+    except HTTPError as e:
+        if e.response is None or \
+           e.response.status_code not in SPLIT_STATUS or \
+           len(base.numbers) < 2:
+            raise
+        profiling.count("gerrit splits")
+        if sizer is not None:
+            sizer.reject(len(base.numbers))
+        half = len(base.numbers) / 2
+        changes = None
+        for part in (base.numbers[:half], base.numbers[half:]):
+            B = Base(numbers=part, dst=base.dst, req=base.req,
+                     options=base.options)
+            part = fetch_batch(B, file_base, retries, sizer)
+            if changes:
+                changes.merge(part)
+            else:
+                changes = part
+        changes.base = base
+        return changes
+    if sizer is not None:
+        sizer.record(len(base.numbers), time.time() - start)
+    return changes
+
+
+def iter_changes(numbers, nmax=75, workers=1, retries=3, req=None,
+                 dst="result-gerrit", file_base=None, sizer=None,
+                 options=QUERY_OPTIONS):
+    """Query numbers in batches and yield Changes per batch.
+
+    Batches hold nmax numbers, or as many as the BatchSizer `sizer`
+    allows, and ask for `options` (see query_options()).  They are sent
+    by up to `workers` threads sharing the session `req` and yielded in
+    the order of `numbers`.  At most 2 * workers batches are in flight,
+    so memory is bounded by the batch size.
+    """
+    if req is None:
+        req = connect(pool_size=workers)
+    if file_base is None:
+        file_base = datetime.now().strftime('%Y-%m%d-%H%M-%S')
+    pool = ThreadPool(workers)
+    pending = deque()
+    i_end = 0
+    i = 0
+    try:
+        while i < len(numbers):
+            if sizer is not None:
+                j = sizer.take(numbers, i)
+            else:
+                j = i + nmax
+            B = Base(numbers=numbers[i:j], dst=dst, req=req, options=options)
+            pending.append(pool.apply_async(fetch_batch,
+                                            (B, file_base, retries, sizer)))
+            i = j
+            while len(pending) >= 2 * workers or \
+                  (pending and i >= len(numbers)):
+                changes = pending.popleft().get()
+                i_start = i_end
+                i_end = i_start + len(changes.base.numbers)
+                print i_start, i_end
+                yield changes
+    finally:
+        pool.terminate()
+
+
+def sync(cache, project, branch, req=None, status=None,
+         dst="result-gerrit"):
+    """Bring the changes of project/branch in cache up to date.
+
+    Only changes updated since the last recorded high-water mark of the
+    branch, for the same `status` filter, are queried.  Every page is
+    stored as it comes; the mark moves only once the last one is in, so
+    a failed sync starts again from the previous mark.  Return the
+    number of changes received.
+    """
+    if req is None:
+        req = connect()
+    since = cache.mark(project, branch, status)
+    B = Base(project=project, branch=branch, dst=dst, req=req)
+    n = 0
+    last = None
+    for page in iter_pages(req, changes_query(B, status, since)):
+        cache.put(page)
+        n += len(page)
+        for c in page:
+            if last is None or c['updated'] > last:
+                last = c['updated']
+    if last is not None:
+        cache.set_mark(project, branch, last, status)
+    return n
+
+
+def fetch_changes(numbers, nmax=75, workers=1, retries=3, req=None,
+                  dst="result-gerrit", file_base=None, sizer=None,
+                  options=QUERY_OPTIONS):
+    """Query numbers in batches and return merged Changes."""
+    C = None
+    for changes in iter_changes(numbers, nmax, workers, retries, req,
+                                dst, file_base, sizer, options):
+        if C:
+            C.merge(changes)
+        else:
+            C = changes
+    return C
+
 
 class GerritAccessError(Exception):
 
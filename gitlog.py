@@ -0,0 +1,251 @@
+""" Stream commits, numstat and blobs out of git with few processes."""
+
+import subprocess
+import threading
+
+import profiling
+
+RS = "\x1e"  # starts every commit record
+FS = "\x1f"  # separates the fields of a record
+FORMAT = RS + FS.join(("%H", "%P", "%ae", "%at", "%ce", "%ct", "%B")) + FS
+
+
+class LogCommit(object):
+
+    """Commit record parsed from `git log`.
+
+    `files` has the shape of GitPython's `Commit.stats.files`: a dict of
+    path -> {'insertions', 'deletions', 'lines'} against the first parent.
+    It is parsed from the raw `numstat` text on first use.  Merges carry
+    no numstat in `git log`, so theirs is asked for on demand.
+    """
+
+    __slots__ = ('repo_dir', 'hexsha', 'parents', 'author', 'authored_date',
+                 'committer', 'committed_date', 'message', 'numstat',
+                 '_files')
+
+    def __init__(self, repo_dir, hexsha, parents, author, authored_date,
+                 committer, committed_date, message, numstat=None):
+        self.repo_dir = repo_dir
+        self.hexsha = hexsha
+        self.parents = parents
+        self.author = author
+        self.authored_date = authored_date
+        self.committer = committer
+        self.committed_date = committed_date
+        self.message = message
+        self.numstat = numstat
+        self._files = None
+
+    @classmethod
+    def parse(cls, repo_dir, record, numstat=True):
+        """Return the LogCommit of one FORMAT record."""
+        fields = record.split(FS)
+        parents = tuple(fields[1].split())
+        text = None
+        if numstat and len(parents) < 2:
+            text = fields[7].strip("\n")
+        return cls(repo_dir, fields[0], parents,
+                   fields[2].decode("utf-8", "replace"), int(fields[3]),
+                   fields[4].decode("utf-8", "replace"), int(fields[5]),
+                   fields[6].decode("utf-8", "replace"), text)
+
+    def state(self):
+        """Return everything but repo_dir and hexsha as a plain tuple."""
+        return (self.parents, self.author, self.authored_date,
+                self.committer, self.committed_date, self.message,
+                self.numstat)
+
+    @property
+    def files(self):
+        if self._files is None:
+            if self.numstat is None:
+                if self.parents:
+                    self.numstat = git(self.repo_dir, "diff", "--numstat",
+                                       self.parents[0], self.hexsha, "--")
+                else:
+                    self.numstat = git(self.repo_dir, "diff-tree", "--root",
+                                       "-r", "--numstat", "--no-commit-id",
+                                       self.hexsha, "--")
+            self._files = parse_numstat(self.numstat)
+        return self._files
+
+
+def parse_numstat(text):
+    """Return path -> {'insertions', 'deletions', 'lines'} of numstat text."""
+    files = {}
+    for line in text.splitlines():
+        if not line:
+            continue
+        raw_insertions, raw_deletions, filename = line.split("\t", 2)
+        insertions = raw_insertions != '-' and int(raw_insertions) or 0
+        deletions = raw_deletions != '-' and int(raw_deletions) or 0
+        filename = filename.strip().decode("utf-8", "replace")
+        files[filename] = {'insertions': insertions,
+                           'deletions': deletions,
+                           'lines': insertions + deletions}
+    return files
+
+
+def revisions(rev_range):
+    """Return rev_range, a string or a list of revisions, as a list."""
+    if isinstance(rev_range, basestring):
+        return [rev_range]
+    return list(rev_range)
+
+
+def git(repo_dir, *args):
+    """Run git in repo_dir and return its output."""
+    profiling.count("git processes")
+    proc = subprocess.Popen(("git",) + args, cwd=repo_dir,
+                            stdout=subprocess.PIPE)
+    out = proc.communicate()[0]
+    if proc.returncode != 0:
+        raise Exception("git %s failed in %s" % (args[0], repo_dir))
+    return out
+
+
+def log_records(repo_dir, args, shas=None, bufsize=1 << 16):
+    """Yield the RS-separated records printed by `git log args`.
+
+    The output is split as it arrives.  `shas`, if given, are fed to
+    `git log --stdin` from a thread.
+    """
+    cmd = ["git", "log"] + list(args)
+    if shas is not None:
+        cmd += ["--no-walk=unsorted", "--stdin"]
+    cmd.append("--")
+    profiling.count("git processes")
+    proc = subprocess.Popen(cmd, cwd=repo_dir, stdout=subprocess.PIPE,
+                            stdin=subprocess.PIPE if shas is not None else None)
+    if shas is not None:
+        def feed():
+            proc.stdin.write("".join(sha + "\n" for sha in shas))
+            proc.stdin.close()
+        t = threading.Thread(target=feed)
+        t.daemon = True
+        t.start()
+    try:
+        buf = ""
+        for chunk in iter(lambda: proc.stdout.read(bufsize), ""):
+            records = (buf + chunk).split(RS)
+            buf = records.pop()
+            for record in records:
+                if record:
+                    yield record
+        if buf:
+            yield buf
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+    if returncode != 0:
+        raise Exception("git log %s failed in %s" % (" ".join(args), repo_dir))
+
+
+def iter_log(repo_dir, rev_range, numstat=True, shas=None, bufsize=1 << 16):
+    """Yield a LogCommit per commit of rev_range, newest first.
+
+    One `git log` process serves the whole range; its output is parsed
+    record by record as it arrives.  rev_range is "a..b" or a list of
+    revisions such as ["b", "c", "^a"].  Given `shas` instead of a
+    range, exactly those commits are listed, in that order.
+    """
+    args = ["--format=" + FORMAT]
+    if numstat:
+        args.append("--numstat")
+    if shas is None:
+        args += revisions(rev_range)
+    for record in log_records(repo_dir, args, shas, bufsize):
+        yield LogCommit.parse(repo_dir, record, numstat)
+
+
+def iter_fields(repo_dir, rev_range, fields):
+    """Yield a tuple of the `git log` placeholders `fields` per commit.
+
+    Commits of rev_range come newest first, like iter_log(), but only
+    the requested fields are formatted and nothing is parsed further:
+    ("%H", "%P", "%ae") yields (hexsha, parents, author email) strings.
+    """
+    args = ["--format=" + RS + FS.join(fields)] + revisions(rev_range)
+    for record in log_records(repo_dir, args):
+        yield tuple(record.rstrip("\n").split(FS))
+
+
+def iter_commits(repo_dir, rev_range, cache=None):
+    """Yield LogCommits of rev_range, taking known ones from a CommitCache.
+
+    Only commits missing from the cache go through `git log`; they are
+    added to the cache on the way.
+    """
+    if cache is None:
+        for c in iter_log(repo_dir, rev_range):
+            yield c
+        return
+    shas = git(repo_dir, "rev-list", *(revisions(rev_range) + ["--"])).split()
+    known = cache.get_many(repo_dir, shas)
+    missing = [sha for sha in shas if sha not in known]
+    if missing:
+        for c in iter_log(repo_dir, rev_range, shas=missing):
+            known[c.hexsha] = c
+        cache.put_many([known[sha] for sha in missing])
+    for sha in shas:
+        yield known[sha]
+
+
+class CatFile(object):
+
+    """One `git cat-file --batch` process serving many blob reads."""
+
+    def __init__(self, repo_dir):
+        self.repo_dir = repo_dir
+        profiling.count("git processes")
+        self.proc = subprocess.Popen(["git", "cat-file", "--batch"],
+                                     cwd=repo_dir, stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE)
+
+    def _header(self):
+        header = self.proc.stdout.readline().split()
+        if len(header) != 3:
+            raise Exception("git cat-file: %s missing in %s" %
+                            (header and header[0], self.repo_dir))
+        return int(header[2])
+
+    def read(self, sha):
+        """Return the content of object sha."""
+        self.proc.stdin.write(sha + "\n")
+        self.proc.stdin.flush()
+        data = self.proc.stdout.read(self._header())
+        self.proc.stdout.read(1)  # newline after the content
+        return data
+
+    def count_lines(self, shas, bufsize=1 << 20):
+        """Yield the number of lines of every blob in shas, in order.
+
+        Requests are written by a thread while replies are read, so git
+        never waits on us between objects.
+        """
+        def feed():
+            for sha in shas:
+                self.proc.stdin.write(sha + "\n")
+            self.proc.stdin.flush()
+        t = threading.Thread(target=feed)
+        t.daemon = True
+        t.start()
+        for sha in shas:
+            size = self._header()
+            n = 0
+            last = "\n"
+            while size:
+                chunk = self.proc.stdout.read(min(size, bufsize))
+                n += chunk.count("\n")
+                last = chunk[-1]
+                size -= len(chunk)
+            self.proc.stdout.read(1)
+            if last != "\n":
+                n += 1  # last line without newline
+            yield n
+        t.join()
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
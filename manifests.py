@@ -0,0 +1,76 @@
+""" Read repo manifests once and compare whole series of them."""
+
+import hashlib
+
+import repo_manifest as rm
+
+import profiling
+
+
+class Manifest(object):
+
+    """Projects of a manifest, shaped like RepoXmlManifest.projects:
+    name -> {u'path', u'revision'}."""
+
+    def __init__(self, filename, projects):
+        self.filename = filename
+        self.projects = projects
+
+
+def load(filename, cache=None):
+    """Return the Manifest of an XML file.
+
+    With a ManifestCache the file is only parsed if no manifest with the
+    same content was parsed before.
+    """
+    with open(filename) as F:
+        text = F.read()
+    digest = hashlib.sha1(text).hexdigest()
+    projects = cache is not None and cache.get(digest) or None
+    if projects is None:
+        with profiling.stage("manifest parse"):
+            M = rm.RepoXmlManifest(text)
+            projects = dict((name,
+                             {u'path': M.projects[name][u'path'],
+                              u'revision': M.projects[name][u'revision']})
+                            for name in M.projects)
+        profiling.count("manifests parsed")
+        if cache is not None:
+            cache.put(digest, projects)
+    else:
+        profiling.count("manifests cached")
+    return Manifest(filename, projects)
+
+
+def changed(M1, M2):
+    """Return project -> {u'path', u'lrev', u'rrev'} for the projects of
+    both manifests whose revision changed; the path is the one in M1."""
+    return diff_series([M1, M2])[0]
+
+
+def diff_series(manifests):
+    """Return changed() of every consecutive pair of manifests.
+
+    All manifests are read in one pass: each project gets its revisions
+    along the series, which are then compared neighbour to neighbour.
+    """
+    series = {}
+    order = []
+    for i, M in enumerate(manifests):
+        for name in M.projects:
+            if name not in series:
+                series[name] = [None] * len(manifests)
+                order.append(name)
+            series[name][i] = M.projects[name]
+    diffs = [{} for i in range(len(manifests) - 1)]
+    for name in order:
+        info = series[name]
+        for i in range(len(diffs)):
+            left, right = info[i], info[i + 1]
+            if left is None or right is None or \
+               left[u'revision'] == right[u'revision']:
+                continue
+            diffs[i][name] = {u'path': left[u'path'],
+                              u'lrev': left[u'revision'],
+                              u'rrev': right[u'revision']}
+    return diffs
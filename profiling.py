@@ -0,0 +1,207 @@
+""" Per-stage timing, counters and progress lines for get-data runs.
+
+Stages are named parts of a run ("manifest parse", "commit walk",
+"stats", "gerrit fetch", "write").  Each one adds up wall time, CPU
+time (this process and its waited-for children, i.e. git) and calls.
+Stages used from several threads add up their calls, so their wall
+time can exceed the run's.  Counters count events such as git
+processes; histograms bucket latencies such as Gerrit requests.
+
+Pool workers send snapshot() back with their results; the parent
+merge()s it.
+"""
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+# Upper bounds in seconds of the histogram buckets; the last is open
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def cpu_time():
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+
+class Profile(object):
+
+    """Stage times, counters and histograms of one process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.histograms = {}
+
+    def add_stage(self, name, wall, cpu, calls=1):
+        with self.lock:
+            s = self.stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0,
+                                              'calls': 0})
+            s['wall'] += wall
+            s['cpu'] += cpu
+            s['calls'] += calls
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        with self.lock:
+            h = self.histograms.setdefault(name, [0] * (len(BUCKETS) + 1))
+            i = 0
+            while i < len(BUCKETS) and seconds > BUCKETS[i]:
+                i += 1
+            h[i] += 1
+
+    def snapshot(self):
+        """Return the stages, counters and histograms as plain data."""
+        with self.lock:
+            return {'stages': dict((k, dict(v))
+                                   for k, v in self.stages.items()),
+                    'counters': dict(self.counters),
+                    'histograms': dict((k, list(v))
+                                       for k, v in self.histograms.items())}
+
+    def merge(self, snapshot):
+        """Add the snapshot() of another process."""
+        for name, s in snapshot['stages'].items():
+            self.add_stage(name, s['wall'], s['cpu'], s['calls'])
+        for name, n in snapshot['counters'].items():
+            self.count(name, n)
+        with self.lock:
+            for name, h in snapshot['histograms'].items():
+                mine = self.histograms.setdefault(name,
+                                                  [0] * (len(BUCKETS) + 1))
+                for i, n in enumerate(h):
+                    mine[i] += n
+
+    def report(self):
+        """Return snapshot() with the run's wall and CPU time and peak RSS."""
+        report = self.snapshot()
+        report['wall'] = time.time() - self.start
+        report['cpu'] = cpu_time()
+        report['buckets'] = list(BUCKETS)
+        # ru_maxrss is in kilobytes on Linux
+        report['peak_rss_kb'] = \
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report['peak_child_rss_kb'] = \
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        return report
+
+
+current = Profile()
+
+
+class stage(object):
+
+    """Context manager adding its time to stage `name`."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.cpu = cpu_time()
+        return self
+
+    def __exit__(self, *exc):
+        current.add_stage(self.name, time.time() - self.wall,
+                          cpu_time() - self.cpu)
+        return False
+
+
+def timed(name, iterable):
+    """Yield from iterable, adding the time spent in it to stage name."""
+    it = iter(iterable)
+    wall = 0.0
+    cpu = 0.0
+    calls = 0
+    try:
+        while True:
+            t0 = time.time()
+            c0 = cpu_time()
+            try:
+                item = next(it)
+            finally:
+                wall += time.time() - t0
+                cpu += cpu_time() - c0
+            calls += 1
+            yield item
+    except StopIteration:
+        pass
+    finally:
+        current.add_stage(name, wall, cpu, calls)
+
+
+def count(name, n=1):
+    current.count(name, n)
+
+
+def observe(name, seconds):
+    current.observe(name, seconds)
+
+
+def reset():
+    """Start a new Profile, e.g. at the start of a pool job."""
+    global current
+    current = Profile()
+
+
+def snapshot():
+    return current.snapshot()
+
+
+def merge(snapshot):
+    current.merge(snapshot)
+
+
+def write_report(path=None):
+    """Write report() as JSON to path, or on one line to stderr."""
+    report = current.report()
+    if path:
+        with open(path, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+    else:
+        sys.stderr.write("profile: %s\n" % json.dumps(report,
+                                                      sort_keys=True))
+
+
+PROGRESS_INTERVAL = 1.0
+_last_progress = [0.0]
+
+
+def progress(fmt, *args):
+    """Print fmt % args unless a progress line went out less than
+    PROGRESS_INTERVAL seconds ago."""
+    now = time.time()
+    if now - _last_progress[0] >= PROGRESS_INTERVAL:
+        _last_progress[0] = now
+        print fmt % args
+
+
+class Worker(object):
+
+    """Pool function calling func(job) in a fresh Profile.
+
+    It returns (result, snapshot()); see merged().
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, job):
+        reset()
+        result = self.func(job)
+        return result, snapshot()
+
+
+def merged(results):
+    """Yield the results of Worker calls, merging their snapshots."""
+    for result, snap in results:
+        merge(snap)
+        yield result
@@ -0,0 +1,190 @@
+""" Compact column stores for the git_changes and git_files rows.
+
+Rows live in typed arrays instead of one dict per row:
+- SHAs are kept as 20 raw bytes.
+- Authors, committers and file paths are interned once per store.
+- Free text is kept UTF-8 encoded.
+
+Rows of a project are contiguous; `segments` maps each project to its
+(start, stop) row range, in the order the projects were added.
+"""
+
+import binascii
+from array import array
+from collections import OrderedDict
+
+
+def utf8(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+
+class Interner(object):
+
+    """Distinct values numbered in order of first appearance."""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def remap(self, other):
+        """Return the codes in self of the values of Interner other."""
+        return [self.code(value) for value in other.values]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class Records(object):
+
+    """Base of the stores: segments per project and row count."""
+
+    def __init__(self):
+        self.segments = OrderedDict()
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def discard(self, project):
+        del self.segments[project]
+
+    def segment(self, project, start):
+        """Record the rows from start to the end as those of project."""
+        self.segments[project] = (start, len(self))
+
+
+class ChangeRecords(Records):
+
+    """git_changes rows, in the order of utils.GIT_COLUMNS.
+
+    The changed lines of every file are kept in `file_lines`, commit
+    after commit; `lines` and `entropy` are computed from them by
+    stats.commit_stats().
+    """
+
+    def __init__(self):
+        super(ChangeRecords, self).__init__()
+        self.people = Interner()
+        self.sha = bytearray()
+        self.merge = array('b')
+        self.author = array('i')
+        self.authored_date = array('l')
+        self.committer = array('i')
+        self.committed_date = array('l')
+        self.files = array('l')
+        self.file_lines = array('l')
+        self.lines = array('l')
+        self.entropy = array('d')
+        self.message = []
+
+    def __len__(self):
+        return len(self.merge)
+
+    def append(self, hexsha, merge, author, authored_date, committer,
+               committed_date, file_lines, message):
+        self.sha += binascii.unhexlify(hexsha)
+        self.merge.append(merge)
+        self.author.append(self.people.code(author))
+        self.authored_date.append(authored_date)
+        self.committer.append(self.people.code(committer))
+        self.committed_date.append(committed_date)
+        self.files.append(len(file_lines))
+        self.file_lines.extend(file_lines)
+        self.message.append(utf8(message))
+
+    def extend(self, project, other):
+        """Append all rows of ChangeRecords other as those of project."""
+        start = len(self)
+        people = self.people.remap(other.people)
+        self.sha += other.sha
+        self.merge.extend(other.merge)
+        self.author.extend(people[i] for i in other.author)
+        self.authored_date.extend(other.authored_date)
+        self.committer.extend(people[i] for i in other.committer)
+        self.committed_date.extend(other.committed_date)
+        self.files.extend(other.files)
+        self.file_lines.extend(other.file_lines)
+        self.message.extend(other.message)
+        self.segment(project, start)
+
+    def hexsha(self, i):
+        return binascii.hexlify(self.sha[20 * i:20 * i + 20])
+
+    def rows(self, project):
+        """Yield the rows of project as GIT_COLUMNS tuples."""
+        people = self.people.values
+        start, stop = self.segments[project]
+        for i in xrange(start, stop):
+            yield (project, self.hexsha(i), bool(self.merge[i]),
+                   people[self.author[i]], self.authored_date[i],
+                   people[self.committer[i]], self.committed_date[i],
+                   self.files[i], self.lines[i], self.entropy[i],
+                   self.message[i])
+
+
+class FileRecords(Records):
+
+    """git_files rows, in the order of utils.FILES_COLUMNS.
+
+    Each commit SHA is stored once; file rows point to it by index.
+    """
+
+    def __init__(self):
+        super(FileRecords, self).__init__()
+        self.paths = Interner()
+        self.sha = bytearray()
+        self.commit = array('l')
+        self.path = array('i')
+        self.lines = array('l')
+        self.insertions = array('l')
+        self.deletions = array('l')
+
+    def __len__(self):
+        return len(self.commit)
+
+    def add_commit(self, hexsha):
+        """Return the index of a new commit for the following rows."""
+        self.sha += binascii.unhexlify(hexsha)
+        return len(self.sha) / 20 - 1
+
+    def append(self, commit, name, lines, insertions, deletions):
+        self.commit.append(commit)
+        self.path.append(self.paths.code(utf8(name)))
+        self.lines.append(lines)
+        self.insertions.append(insertions)
+        self.deletions.append(deletions)
+
+    def extend(self, project, other):
+        """Append all rows of FileRecords other as those of project."""
+        start = len(self)
+        offset = len(self.sha) / 20
+        paths = self.paths.remap(other.paths)
+        self.sha += other.sha
+        self.commit.extend(offset + i for i in other.commit)
+        self.path.extend(paths[i] for i in other.path)
+        self.lines.extend(other.lines)
+        self.insertions.extend(other.insertions)
+        self.deletions.extend(other.deletions)
+        self.segment(project, start)
+
+    def rows(self, project):
+        """Yield the rows of project as FILES_COLUMNS tuples."""
+        paths = self.paths.values
+        start, stop = self.segments[project]
+        last = None
+        for i in xrange(start, stop):
+            commit = self.commit[i]
+            if commit != last:
+                hexsha = binascii.hexlify(self.sha[20 * commit:
+                                                   20 * commit + 20])
+                last = commit
+            yield (hexsha, paths[self.path[i]], self.lines[i],
+                   self.insertions[i], self.deletions[i])
@@ -1,27 +1,196 @@
-import csv
 import git
+import itertools
+import multiprocessing
 import os
-import re
-import repo_manifest as rm
+import posixpath
+
+import gitlog
+import manifests
+import profiling
+import writers
 
 FILE_JAVA = ".*\.(java|jav|aidl)$"
 FILE_MAKE = ".*(Makefile|\.mk)$"
 FILE_CPP = ".*\.(c|cpp|cc|h|hpp)$"
 FILE_ANDROIDXML = ".*AndroidManifest\.xml$"
 
-def file_len(fname):
-    with open(fname) as f:
-        for i, l in enumerate(f):
-            pass
+SNAPSHOT_COLUMNS = (('project', 'category'), ('rev', 'str'),
+                    ('n_java', 'int'), ('n_make', 'int'), ('n_cpp', 'int'),
+                    ('n_androidxml', 'int'), ('l_java', 'int'),
+                    ('l_make', 'int'), ('l_cpp', 'int'))
+
+# Extension lookup equivalent to the FILE_* patterns above
+EXT_KIND = {'.java': 'java', '.jav': 'java', '.aidl': 'java',
+            '.mk': 'make',
+            '.c': 'cpp', '.cpp': 'cpp', '.cc': 'cpp', '.h': 'cpp',
+            '.hpp': 'cpp'}
+
+def file_kind(name):
+    """Return 'java', 'make', 'cpp', 'androidxml' or None for a file name."""
+    i = name.rfind('.')
+    if i >= 0:
+        kind = EXT_KIND.get(name[i:])
+        if kind is not None:
+            return kind
+    if name.endswith("Makefile"):
+        return 'make'
+    if name.endswith("AndroidManifest.xml"):
+        return 'androidxml'
+    return None
+
+def file_len(fname, bufsize=1 << 20):
+    """Return the number of lines of fname, counted in binary chunks."""
+    n = 0
+    last = '\n'
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(bufsize), ''):
+            n += chunk.count('\n')
+            last = chunk[-1]
+    if last != '\n':
+        n += 1  # last line without newline
+    return n
+
+def measure_tree(path, exclude_dir=".git"):
+    """Return (n_java, n_make, n_cpp, n_androidxml, l_java, l_make, l_cpp).
+
+    Directories whose name contains exclude_dir are not descended into.
+    """
+    n = {'java': 0, 'make': 0, 'cpp': 0, 'androidxml': 0}
+    l = {'java': 0, 'make': 0, 'cpp': 0}
+    for r,d,files in os.walk(path):
+        d[:] = [x for x in d if exclude_dir not in x]
+        for f in files:
+            kind = file_kind(f)
+            if kind is None:
+                continue
+            n[kind] += 1
+            if kind in l:
+                l[kind] += file_len(os.path.join(r, f))
+    return (n['java'], n['make'], n['cpp'], n['androidxml'],
+            l['java'], l['make'], l['cpp'])
+
+def resolve_link(name, links, read, max_hops=40):
+    """Return where the symlink name of a tree leads, following links.
+
+    links maps the symlinks of the tree to their blob SHAs and read()
+    returns the text of a blob.  Links met on the way, the last path
+    component or any directory above it, are followed as the OS does.
+    The result is relative to the tree, or starts with "/" or "../"
+    once it leaves it; None after max_hops links, as for a loop.
+    """
+    for _ in range(max_hops):
+        parts = name.split("/")
+        for i in range(1, len(parts) + 1):
+            link = "/".join(parts[:i])
+            if link in links:
+                name = posixpath.normpath(posixpath.join(
+                    posixpath.dirname(link), read(links[link]), *parts[i:]))
+                break
+        else:
+            return name
+        if name.startswith("/") or name == ".." or name.startswith("../"):
+            return name
+    return None
+
+def measure_revision(path, rev, exclude_dir=".git", cache=None):
+    """Return the measure_tree() counts of rev, read from git objects.
+
+    Nothing is checked out: files come from `git ls-tree` and lines are
+    counted on blobs streamed by `git cat-file --batch`.  Symlinks are
+    followed as in a checkout: through other links, and to the working
+    tree on disk for targets outside the project, which are read as
+    they are checked out there.  Links to directories are not files, as
+    for os.walk(); dangling links count as files without lines, where
+    measure_tree() cannot open them.  Submodules are skipped.  Blobs
+    found in the BlobCache `cache` are not read at all.
+    """
+    listing = gitlog.git(path, "ls-tree", "-r", "-l", "-z", rev)
+    blobs = {}
+    links = {}
+    entries = []
+    for entry in listing.split("\0"):
+        if not entry:
+            continue
+        meta, name = entry.split("\t", 1)
+        mode, otype, sha = meta.split()[:3]
+        if otype != "blob":
+            continue
+        blobs[name] = sha
+        if mode == "120000":
+            links[name] = sha
+        dirs = name.split("/")
+        if [x for x in dirs[:-1] if exclude_dir in x]:
+            continue
+        kind = file_kind(dirs[-1])
+        if kind is not None:
+            entries.append((kind, sha, mode, name))
+
+    n = {'java': 0, 'make': 0, 'cpp': 0, 'androidxml': 0}
+    l = {'java': 0, 'make': 0, 'cpp': 0}
+    counted = []
+    texts = {}
+    dirs = set()
+    if links:
+        for name in blobs:
+            parts = name.split("/")
+            dirs.update("/".join(parts[:i]) for i in range(1, len(parts)))
+    cat = gitlog.CatFile(path)
+
+    def read(sha):
+        if sha not in texts:
+            texts[sha] = cat.read(sha)
+        return texts[sha]
+
     try:
-        return i + 1
-    except UnboundLocalError:
-        return 0
+        for kind, sha, mode, name in entries:
+            if mode == "120000":
+                target = resolve_link(name, links, read)
+                if target is None:
+                    n[kind] += 1
+                    continue
+                if target.startswith("/") or target.startswith(".."):
+                    disk = os.path.normpath(os.path.join(path, target))
+                    if os.path.isdir(disk):
+                        continue
+                    n[kind] += 1
+                    if kind in l and os.path.isfile(disk):
+                        l[kind] += file_len(disk)
+                    continue
+                if target in dirs:
+                    continue
+                n[kind] += 1
+                sha = blobs.get(target)
+                if sha is None:
+                    continue  # dangling
+            else:
+                n[kind] += 1
+            if kind in l:
+                counted.append((kind, sha))
+        unique = list(set(sha for kind, sha in counted))
+        lines = {}
+        if cache is not None:
+            lines = cache.get_many(unique)
+            unique = [sha for sha in unique if sha not in lines]
+        new = dict(zip(unique, cat.count_lines(unique)))
+        if cache is not None and new:
+            cache.put_many(new)
+        lines.update(new)
+    finally:
+        cat.close()
+    for kind, sha in counted:
+        l[kind] += lines[sha]
+    return (n['java'], n['make'], n['cpp'], n['androidxml'],
+            l['java'], l['make'], l['cpp'])
+
+def _measure(job):
+    with profiling.stage("measure"):
+        if job[0] == "objects":
+            return measure_revision(*job[1:])
+        return measure_tree(*job[1:])
 
 class RepoSnapshots(object):
-    def __init__(self, manifest, repo_path="."):
-        F = open(manifest)
-        M = rm.RepoXmlManifest(''.join(F.readlines()))
+    def __init__(self, manifest, repo_path=".", cache=None):
+        M = manifests.load(manifest, cache)
         self.Repo = {}
         notfound = 0
         for project in M.projects:
@@ -40,37 +209,39 @@ class RepoSnapshots(object):
     def checkout(self):
         for project in self.Repo:
             rev = self.Repo[project]['revision']
+            profiling.count("git processes")
             self.Repo[project]['Git'].checkout(rev)
 
-    def measure_files(self, exclude_dir=".git", filename="test.csv"):
-        with open(filename, 'w') as fp:
-            a = csv.writer(fp)
-            a.writerow(('project', 'rev', 'n_java', 'n_make', 'n_cpp',
-			'n_androidxml', 'l_java', 'l_make', 'l_cpp'))
-            for project in self.Repo:
-                path = self.Repo[project]['path']
-                n_java = 0
-                n_make = 0
-                n_cpp = 0
-                n_androidxml = 0
-                l_java = 0
-                l_make = 0
-                l_cpp = 0
-                for r,d,files in os.walk(path):
-                    for f in files:
-                        if not exclude_dir in r:
-                            if re.match(FILE_JAVA, f):
-                                n_java += 1
-                                l_java += file_len(os.path.join(r, f))
-                            elif re.match(FILE_MAKE, f):
-                                n_make += 1
-                                l_make += file_len(os.path.join(r, f))
-                            elif re.match(FILE_CPP, f):
-                                n_cpp += 1
-                                l_cpp += file_len(os.path.join(r, f))
-                            elif re.match(FILE_ANDROIDXML, f):
-                                n_androidxml += 1
+    def measure_files(self, exclude_dir=".git", filename="test.csv",
+                      workers=1, from_objects=False, cache=None, fmt='csv'):
+        """Write file counts per project to filename.
+
+        With from_objects the manifest revisions are read from git objects
+        and the working trees are neither checked out nor walked; line
+        counts of blobs are then kept in the BlobCache `cache`.
+        """
+        projects = list(self.Repo)
+        if from_objects:
+            jobs = [("objects", self.Repo[project]['path'],
+                     self.Repo[project]['revision'], exclude_dir, cache)
+                    for project in projects]
+        else:
+            jobs = [("tree", self.Repo[project]['path'], exclude_dir)
+                    for project in projects]
+        pool = None
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            results = profiling.merged(
+                pool.imap(profiling.Worker(_measure), jobs))
+        else:
+            results = (_measure(job) for job in jobs)
+        a = writers.open_table(filename, SNAPSHOT_COLUMNS, fmt)
+        try:
+            for project, counts in itertools.izip(projects, results):
                 rev = self.Repo[project]['revision'][0:7]
-                row = (project, rev, n_java, n_make, n_cpp, n_androidxml,
-                       l_java, l_make, l_cpp)
-                a.writerow(row)
+                with profiling.stage("write"):
+                    a.writerow((project, rev) + counts)
+        finally:
+            a.close()
+            if pool is not None:
+                pool.terminate()
@@ -0,0 +1,258 @@
+""" Split get-data work into shards and merge their partial outputs.
+
+A run with --shard=I/N does the part I (0 <= I < N) of the work:
+- git and files: the projects whose MD5 modulo N is I;
+- gerrit: the I-th of N ranges of whole batches of the SHA list.
+
+Each table of a shard goes to <outdir>/shard-I-of-N/<file> next to a
+<file>.shard.json sidecar describing it: the single-run output it is
+part of, its columns and format, and where the rows of each part
+(project or SHA range) lie in it.  merge() puts the parts of all
+shards back in single-run order.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import writers
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+SIDECAR = ".shard.json"
+# Multiples of a timestamp unit in nanoseconds and seconds
+NANOSECONDS = {'s': 1000000000, 'ms': 1000000, 'us': 1000, 'ns': 1}
+
+
+class Shard(object):
+
+    """Part `index` of `count` of the work, from "I/N"."""
+
+    def __init__(self, spec):
+        try:
+            index, count = [int(x) for x in spec.split("/")]
+        except ValueError:
+            raise Exception("--shard wants I/N, not %s" % spec)
+        if not 0 <= index < count:
+            raise Exception("--shard=%s: I must be from 0 to N-1" % spec)
+        self.index = index
+        self.count = count
+
+    def __str__(self):
+        return "%d/%d" % (self.index, self.count)
+
+    def has(self, project):
+        """Return whether project belongs to this shard."""
+        return int(hashlib.md5(writers.utf8(project)).hexdigest(),
+                   16) % self.count == self.index
+
+    def range(self, n, nmax):
+        """Return (start, stop) of this shard of n SHAs queried nmax at a
+        time, so that its batches are those of a single run."""
+        batches = (n + nmax - 1) // nmax
+        start = batches * self.index // self.count * nmax
+        stop = batches * (self.index + 1) // self.count * nmax
+        return min(start, n), min(stop, n)
+
+    def path(self, output):
+        """Return where this shard writes its part of output."""
+        return os.path.join(os.path.dirname(output),
+                            "shard-%d-of-%d" % (self.index, self.count),
+                            os.path.basename(output))
+
+
+class ShardTable(object):
+
+    """Writers table of one shard of output, in parts.
+
+    part(key) starts the rows of a part; keys are lists sorting the
+    parts into single-run order.  The sidecar is written on close(),
+    with `info` (e.g. the split used) added to it.
+    """
+
+    def __init__(self, output, columns, fmt, shard, **info):
+        path = shard.path(output)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.table = writers.open_table(path, columns, fmt)
+        self.fmt = fmt
+        self.rows = 0
+        self.parts = []
+        self.sidecar = dict(info, output=output, format=fmt,
+                            columns=columns, shard=shard.index,
+                            shards=shard.count,
+                            file=os.path.basename(self.table.path))
+        self.sidecar['header'] = self.position()
+
+    def position(self):
+        """Return the byte (CSV) or row offset of the next row."""
+        if self.fmt == 'csv':
+            return self.table.size()
+        return self.rows
+
+    def end_part(self):
+        if self.parts:
+            self.parts[-1][2] = self.position()
+
+    def part(self, key):
+        self.end_part()
+        self.parts.append([key, self.position(), None])
+
+    def writerow(self, row):
+        self.table.writerow(row)
+        self.rows += 1
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        self.end_part()
+        self.table.close()
+        self.sidecar['parts'] = self.parts
+        with open(self.table.path + SIDECAR, "w") as fp:
+            json.dump(self.sidecar, fp, indent=1, sort_keys=True)
+
+
+def open_table(filename, columns, fmt='csv', shard=None, **info):
+    """Return writers.open_table(), or a ShardTable of shard."""
+    if shard is None:
+        return writers.open_table(filename, columns, fmt)
+    return ShardTable(filename, columns, fmt, shard, **info)
+
+
+def grouped(table, rows, key):
+    """Yield rows, starting a part of table whenever key(row) changes."""
+    last = None
+    for row in rows:
+        k = key(row)
+        if k != last:
+            table.part(k)
+            last = k
+        yield row
+
+
+def find_sidecars(paths):
+    """Return the sidecars in paths and, recursively, their directories."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for d, dirs, files in os.walk(path):
+                dirs.sort()
+                found += [os.path.join(d, f) for f in sorted(files)
+                          if f.endswith(SIDECAR)]
+        elif path.endswith(SIDECAR):
+            found.append(path)
+    return found
+
+
+def part_keys(sidecars):
+    """Return a function sorting part keys into single-run order.
+
+    Keys are lists; a 'people' sidecar entry (project key -> people in
+    order of first appearance) turns a person in second place into the
+    number the single run gave it, that of its first appearance over
+    the projects in order.
+    """
+    people = {}
+    for s in sidecars:
+        people.update(s.get('people', {}))
+    if not people:
+        return lambda key: key
+    codes = {}
+    for project in sorted(people, key=int):
+        for person in people[project]:
+            codes.setdefault(person, len(codes))
+    return lambda key: [key[0], codes[key[1]]]
+
+
+def _gerrit_time(ns):
+    if ns is None:
+        return ''
+    seconds, ns = divmod(ns, 1000000000)
+    return "%s.%09d" % (time.strftime("%Y-%m-%d %H:%M:%S",
+                                      time.gmtime(seconds)), ns)
+
+
+def read_rows(path, columns, fmt):
+    """Return the rows of a Parquet or Arrow table as they were written."""
+    if pa is None:
+        raise Exception("pyarrow is needed for %s output" % fmt)
+    if fmt == 'parquet':
+        table = pq.read_table(path)
+    else:
+        table = pa.ipc.open_file(path).read_all()
+    values = []
+    for i, (name, kind) in enumerate(columns):
+        column = []
+        for chunk in table.column(i).chunks:
+            if kind in ('epoch', 'gerrit_time'):
+                # Stored in any unit; back to seconds or nanoseconds
+                scale = NANOSECONDS[chunk.type.unit]
+                per = NANOSECONDS['s'] if kind == 'epoch' else 1
+                column += [v if v is None else v * scale // per
+                           for v in chunk.cast(pa.int64()).to_pylist()]
+            else:
+                column += chunk.to_pylist()
+        if kind == 'gerrit_time':
+            column = [_gerrit_time(v) for v in column]
+        values.append(column)
+    return zip(*values)
+
+
+def merge_output(output, sidecars):
+    """Write output from the shards described by sidecars."""
+    first = sidecars[0]
+    count = first['shards']
+    indexes = sorted(s['shard'] for s in sidecars)
+    if indexes != range(count):
+        raise Exception("%s: have shards %s of %d" % (output, indexes,
+                                                      count))
+    for s in sidecars:
+        if s['columns'] != first['columns'] or \
+           s['format'] != first['format']:
+            raise Exception("%s: shards of different runs" % output)
+    fmt = first['format']
+    key = part_keys(sidecars)
+    parts = sorted(((key(k), s, start, stop) for s in sidecars
+                    for k, start, stop in s['parts']), key=lambda p: p[0])
+    if os.path.dirname(output) and not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    if fmt == 'csv':
+        # Raw bytes: the header once, then every part as written
+        with open(output, "wb") as out:
+            with open(first['path'], "rb") as fp:
+                out.write(fp.read(first['header']))
+            for k, s, start, stop in parts:
+                with open(s['path'], "rb") as fp:
+                    fp.seek(start)
+                    out.write(fp.read(stop - start))
+        return
+    columns = [tuple(c) for c in first['columns']]
+    rows = {}
+    a = writers.open_table(output, columns, fmt)
+    try:
+        for k, s, start, stop in parts:
+            if s['path'] not in rows:
+                rows[s['path']] = read_rows(s['path'], columns, fmt)
+            a.writerows(rows[s['path']][start:stop])
+    finally:
+        a.close()
+
+
+def merge(paths):
+    """Merge the shard outputs found in paths; return the outputs."""
+    outputs = {}
+    for sidecar in find_sidecars(paths):
+        with open(sidecar) as fp:
+            s = json.load(fp)
+        s['path'] = os.path.join(os.path.dirname(sidecar), s['file'])
+        outputs.setdefault(s['output'], []).append(s)
+    for output in sorted(outputs):
+        merge_output(output, outputs[output])
+    return sorted(outputs)
@@ -0,0 +1,179 @@
+""" Commit metrics computed with NumPy over a whole ChangeRecords store.
+
+Per-file values are laid out commit after commit, so per-commit sums are
+np.add.reduceat() over the segment offsets of each commit; float sums
+that must match a Python loop add the files of all commits in step.  Per-author
+and per-window figures sort commits by their group keys and reduce over
+the offsets where a new group begins.  Nothing loops over files or
+commits in Python.
+"""
+
+from array import array
+
+import numpy as np
+
+import profiling
+
+DAY = 86400
+LOG2 = np.log(2)
+
+
+def column(values, dtype):
+    """Return an array.array or bytearray column as a NumPy view."""
+    return np.frombuffer(values, dtype)
+
+
+def segment_sums(values, counts):
+    """Return the sums of consecutive segments of counts[i] values."""
+    sums = np.zeros(len(counts), values.dtype)
+    nonempty = counts > 0
+    if nonempty.any():
+        starts = np.cumsum(counts) - counts
+        sums[nonempty] = np.add.reduceat(values, starts[nonempty])
+    return sums
+
+
+def ordered_sums(values, counts):
+    """Like segment_sums(), adding the values of a segment left to right.
+
+    Floats then round as in a Python loop over the segment, where
+    np.add.reduceat() may add them pairwise.  One step per position in
+    the longest segment adds that value to every segment long enough.
+    """
+    sums = np.zeros(len(counts), values.dtype)
+    if not len(counts):
+        return sums
+    starts = np.cumsum(counts) - counts
+    order = np.argsort(counts, kind='mergesort')[::-1]
+    ascending = counts[order[::-1]]
+    for j in xrange(ascending[-1]):
+        longer = order[:len(order) - np.searchsorted(ascending, j, 'right')]
+        sums[longer] += values[starts[longer] + j]
+    return sums
+
+
+def entropy(lines, counts):
+    """Return the normalized Shannon entropy of the lines of every commit.
+
+    lines holds the changed lines of each file, commit after commit, and
+    counts the number of files of each commit.  Files without changed
+    lines add nothing, and a commit without changed lines has entropy 0.
+    Terms are added file after file, as the math.log(p, 2) ones of the
+    former per-commit loop, so the values match it to the last digit.
+    """
+    totals = segment_sums(lines, counts)
+    per_file = np.repeat(totals, counts).astype(float)
+    p = lines / np.where(per_file > 0, per_file, 1.0)
+    p = np.where(p > 0, p, 1.0)  # log(1) = 0 for empty files
+    ent = ordered_sums(-1.0 * p * (np.log(p) / LOG2), counts) + 0.0
+    normalize = (ent != 0.0) & (counts > 1)
+    ent[normalize] /= np.log(counts[normalize]) / LOG2
+    return totals, ent
+
+
+def commit_stats(records):
+    """Set the lines and entropy columns of ChangeRecords records."""
+    with profiling.stage("stats"):
+        counts = column(records.files, np.int_)
+        lines, ent = entropy(column(records.file_lines, np.int_), counts)
+        records.lines = array('l', lines.astype(np.int_).tostring())
+        records.entropy = array('d', ent.tostring())
+
+
+def projects_of(records):
+    """Return (projects by first row, project index of every row)."""
+    projects = sorted(records.segments, key=lambda p: records.segments[p])
+    counts = [records.segments[p][1] - records.segments[p][0]
+              for p in projects]
+    return projects, np.repeat(np.arange(len(projects)), counts)
+
+
+def groups(*keys):
+    """Return (order, starts) grouping rows by keys.
+
+    order sorts the rows by keys, the first key most significant; starts
+    are the offsets in that order where a new combination begins.
+    """
+    order = np.lexsort(keys[::-1])
+    new = np.zeros(len(order), bool)
+    new[:1] = True
+    for key in keys:
+        k = key[order]
+        new[1:] |= k[1:] != k[:-1]
+    return order, np.flatnonzero(new)
+
+
+def reduce_groups(ufunc, values, order, starts):
+    if not len(starts):
+        return values[:0]
+    return ufunc.reduceat(values[order], starts)
+
+
+def project_summary(records):
+    """Return project -> {'noc', 'nof', 'nol', 'noa', 'entropy', 'first',
+    'last'} of ChangeRecords records."""
+    projects, project = projects_of(records)
+    author = column(records.author, np.intc)
+    date = column(records.authored_date, np.int_)
+    order, starts = groups(project)
+    noc = np.diff(np.append(starts, len(order)))
+    nof = reduce_groups(np.add, column(records.files, np.int_), order, starts)
+    nol = reduce_groups(np.add, column(records.lines, np.int_), order, starts)
+    ent = reduce_groups(np.add, column(records.entropy, float), order, starts)
+    first = reduce_groups(np.minimum, date, order, starts)
+    last = reduce_groups(np.maximum, date, order, starts)
+    pairs, pair_starts = groups(project, author)
+    noa = np.bincount(project[pairs[pair_starts]], minlength=len(projects))
+    summary = {}
+    for i, p in enumerate(project[order[starts]]):
+        summary[projects[p]] = {'noc': int(noc[i]), 'nof': int(nof[i]),
+                                'nol': int(nol[i]), 'noa': int(noa[p]),
+                                'entropy': float(ent[i] / noc[i]),
+                                'first': int(first[i]), 'last': int(last[i])}
+    return summary
+
+
+def author_rows(records):
+    """Yield (project, author, commits, files, lines, share of the project
+    lines, first, last) per author of each project."""
+    projects, project = projects_of(records)
+    author = column(records.author, np.intc)
+    date = column(records.authored_date, np.int_)
+    lines = column(records.lines, np.int_)
+    order, starts = groups(project, author)
+    commits = np.diff(np.append(starts, len(order)))
+    files = reduce_groups(np.add, column(records.files, np.int_), order,
+                          starts)
+    churn = reduce_groups(np.add, lines, order, starts)
+    first = reduce_groups(np.minimum, date, order, starts)
+    last = reduce_groups(np.maximum, date, order, starts)
+    p = project[order[starts]]
+    total = np.bincount(project, lines, len(projects))[p]
+    share = churn / np.where(total > 0, total, 1.0)
+    people = records.people.values
+    for i, a in enumerate(author[order[starts]]):
+        yield (projects[p[i]], people[a], int(commits[i]), int(files[i]),
+               int(churn[i]), float(share[i]), int(first[i]), int(last[i]))
+
+
+def rate_rows(records, window=7 * DAY):
+    """Yield (project, window start, commits, authors, lines) per window of
+    `window` seconds with commits, by authored date."""
+    projects, project = projects_of(records)
+    start = column(records.authored_date, np.int_) // window * window
+    author = column(records.author, np.intc)
+    order, starts = groups(project, start)
+    commits = np.diff(np.append(starts, len(order)))
+    lines = reduce_groups(np.add, column(records.lines, np.int_), order,
+                          starts)
+    # Distinct authors: count one commit per (project, window, author)
+    window_id = np.empty(len(order), np.int_)
+    window_id[order] = np.repeat(np.arange(len(starts)), commits)
+    triples, triple_starts = groups(project, start, author)
+    authors = np.bincount(window_id[triples[triple_starts]],
+                          minlength=len(starts))
+    p = project[order[starts]]
+    s = start[order[starts]]
+    for i in xrange(len(starts)):
+        yield (projects[p[i]], int(s[i]), int(commits[i]), int(authors[i]),
+               int(lines[i]))
@@ -1,15 +1,38 @@
 import csv
 import git
-import math
+import itertools
+import multiprocessing
 import os
 import re
-import repo_manifest as rm
 import sys
-import time
+from collections import OrderedDict
 
 import gerrit.get_rawdata as gerrit
+import gitlog
+import manifests
+import profiling
+import shards
+import stats
+import writers
+from records import ChangeRecords, FileRecords, Interner
+from writers import DATE_FORMAT
 
-DATE_FORMAT = '%Y/%m/%d %H:%M:%S'
+GIT_COLUMNS = (('project', 'category'), ('hexsha', 'str'), ('merge', 'bool'),
+               ('author', 'category'), ('authored_date', 'epoch'),
+               ('committer', 'category'), ('committed_date', 'epoch'),
+               ('files', 'int'), ('lines', 'int'), ('entropy', 'float'),
+               ('message', 'str'))
+FILES_COLUMNS = (('hexsha', 'str'), ('file', 'str'), ('lines', 'int'),
+                 ('insertions', 'int'), ('deletions', 'int'))
+SUMMARY_COLUMNS = (('project', 'category'), ('commits', 'int'),
+                   ('files', 'int'), ('lines', 'int'), ('authors', 'int'),
+                   ('entropy', 'float'), ('first', 'epoch'),
+                   ('last', 'epoch'))
+AUTHORS_COLUMNS = (('project', 'category'), ('author', 'category'),
+                   ('commits', 'int'), ('files', 'int'), ('lines', 'int'),
+                   ('share', 'float'), ('first', 'epoch'), ('last', 'epoch'))
+RATES_COLUMNS = (('project', 'category'), ('window', 'epoch'),
+                 ('commits', 'int'), ('authors', 'int'), ('lines', 'int'))
 FILE_TYPE = ".*(Makefile|\.(java|jav|aidl|c|cpp|cc|h|hpp|mk|))$"
 
 def filter_files(pattern, files):
@@ -20,21 +43,114 @@ def filter_files(pattern, files):
     return out
 
 
+def git_changes_of(project, commits, exclude_merge=True, filetype=FILE_TYPE,
+                   progress=None):
+    """Return (ChangeRecords, number of commits, number of merges).
+
+    Only the changed lines of each file are collected; totals and entropy
+    are left to stats.commit_stats().  A progress line is printed now
+    and then (profiling.progress) if `progress` is the number of commits
+    seen so far.
+    """
+    changes = ChangeRecords()
+    count = 0
+    num_merge = 0
+    for c in commits:
+        count += 1
+        if progress is not None:
+            profiling.progress("%d, %s (%s) ", progress + count,
+                               c.hexsha[0:7], project)
+        try:
+            is_merge = len(c.parents) is 2
+            num_merge += is_merge
+            if is_merge and exclude_merge:
+                continue
+            filtered_files = filter_files(filetype, c.files)
+            lines = [filtered_files[f]['lines'] for f in filtered_files]
+            changes.append(c.hexsha, is_merge, c.author, c.authored_date,
+                           c.committer, c.committed_date, lines, c.message)
+        except LookupError:
+            print "Warning: Encoding issue"
+            pass
+    return changes, count, num_merge
+
+
+def git_files_of(project, commits, exclude_merge=True, filetype=".*",
+                 progress=None):
+    """Return (FileRecords, number of commits, number of merges)."""
+    files = FileRecords()
+    count = 0
+    num_merge = 0
+    for c in commits:
+        count += 1
+        if progress is not None:
+            profiling.progress("%d, %s (%s) ", progress + count,
+                               c.hexsha[0:7], project)
+        try:
+            is_merge = len(c.parents) is 2
+            num_merge += is_merge
+            if is_merge and exclude_merge:
+                continue
+            filtered_files = filter_files(filetype, c.files)
+            if not filtered_files:
+                continue
+
+            commit = files.add_commit(c.hexsha)
+            for f in filtered_files:
+                deletions = filtered_files[f]['deletions']
+                insertions = filtered_files[f]['insertions']
+                lines = filtered_files[f]['lines']
+                files.append(commit, f, lines, insertions, deletions)
+        except LookupError:
+            print "Warning: Encoding issue"
+            pass
+    return files, count, num_merge
+
+
+MINERS = {'changes': git_changes_of, 'files': git_files_of}
+
+
+def _cached_batches(cache, numbers, shas, nmax, base):
+    """Yield (SHAs, gerrit.Changes) of cached changes, nmax at a time.
+
+    numbers and shas come from ChangeCache.split(); only one batch of
+    payloads is read from the cache at a time.
+    """
+    for i in range(0, len(numbers), nmax):
+        part = numbers[i:i + nmax]
+        yield ([sha for x in part for sha in shas[x]],
+               gerrit.Changes(base, data=cache.get_many(part)))
+
+
+def _mine_project(job):
+    """Pool worker: mine one project range."""
+    miner, project, path, rev_range, exclude_merge, filetype, cache = job
+    commits = profiling.timed("commit walk",
+                              gitlog.iter_commits(path, rev_range,
+                                                  cache=cache))
+    return MINERS[miner](project, commits, exclude_merge, filetype)
+
+
+def _load_span(job):
+    """Pool worker: put the commits of one project span into a cache."""
+    path, revs, cache = job
+    n = 0
+    for c in profiling.timed("commit walk",
+                             gitlog.iter_commits(path, revs, cache=cache)):
+        n += 1
+    return n
+
+
 class ManifestSha1Comparator(object):
-    def __init__(self, lmani, rmani):
-        F1 = open(lmani)
-        F2 = open(rmani)
-        M1 = rm.RepoXmlManifest(''.join(F1.readlines()))
-        M2 = rm.RepoXmlManifest(''.join(F2.readlines()))
-        C = rm.ManifestComparator(M1, M2)
-        self.common_changed_more = {}
-
-        for project in C.common_changed:
-            path = M1.projects[project][u'path']
-            lrev = M1.projects[project][u'revision']
-            rrev = M2.projects[project][u'revision']
-            self.common_changed_more[project] = {u'path': path,
-                                                 u'lrev': lrev, u'rrev': rrev}
+    def __init__(self, lmani, rmani, cache=None):
+        """Find the projects whose revision changed from lmani to rmani.
+
+        Manifests already parsed into the ManifestCache `cache` are not
+        parsed again.
+        """
+        M1 = manifests.load(lmani, cache)
+        M2 = manifests.load(rmani, cache)
+        self.common_changed_more = manifests.changed(M1, M2)
 
     def csv_report(self):
         filename = "test.csv"
@@ -49,208 +165,454 @@ class ManifestSha1Comparator(object):
                 row = (project, path, lrev, rrev)
                 a.writerow(row)
 
+def find_repo(path, repos=None):
+    """Return the working dir of the git repository at path, or None.
+
+    Lookups are remembered in the dict `repos` if one is given.
+    """
+    if repos is not None and path in repos:
+        return repos[path]
+    try:
+        working_dir = git.Repo(path).working_dir
+    except git.exc.NoSuchPathError:
+        working_dir = None
+    if repos is not None:
+        repos[path] = working_dir
+    return working_dir
+
+
 class RepoCommits(object):
-    def __init__(self, common_changed_more, repo_path="."):
-        self.commits = {}
+    def __init__(self, common_changed_more, repo_path=".", repos=None):
+        """Find the repository and revision range of every project.
+
+        No commit is read here; iter_commits() and mine() walk the
+        ranges when a subcommand asks for them.  `repos` shares opened
+        repositories between instances (see find_repo).  Projects are
+        taken in name order, whatever the order of the manifests, so
+        that every run (or shard, see shard()) writes them alike.
+        """
+        self.ranges = OrderedDict()
+        self.sharding = None
+        self.order = None
         notfound = 0
-        for project in common_changed_more.keys():
+        for project in sorted(common_changed_more):
             path = common_changed_more[project]['path']
             lrev = common_changed_more[project]['lrev']
             rrev = common_changed_more[project]['rrev']
-            try:
-                G = git.Repo(os.path.join(repo_path, path))
-                self.commits[project] = list(G.iter_commits(lrev + ".." + rrev))
-            except git.exc.NoSuchPathError:
+            working_dir = find_repo(os.path.join(repo_path, path), repos)
+            if working_dir is None:
                 notfound += 1
-                pass
-        print "%d/%d projects found in %s/" % (len(self.commits), len(common_changed_more),
+                continue
+            self.ranges[project] = (working_dir, lrev + ".." + rrev)
+        print "%d/%d projects found in %s/" % (len(self.ranges), len(common_changed_more),
                                                repo_path)
 
+    def shard(self, shard):
+        """Keep only the projects of shards.Shard shard.
+
+        self.order keeps the place of every project in the whole run;
+        the measure_*() tables then go to shard, in parts by project.
+        """
+        self.order = dict((p, i) for i, p in enumerate(self.ranges))
+        self.ranges = OrderedDict((p, r) for p, r in self.ranges.items()
+                                  if shard.has(p))
+        self.sharding = shard
+        print "Shard %s: %d projects" % (shard, len(self.ranges))
+
+    def open_table(self, filename, columns, fmt, **info):
+        return shards.open_table(filename, columns, fmt, self.sharding,
+                                 split="project", **info)
+
+    def part(self, table, project):
+        """Start the rows of project in a table of a shard."""
+        if self.sharding is not None:
+            table.part([self.order[project]])
+
     def count_commits(self):
         l = 0
-        for project in self.commits:
-            l += len(self.commits[project])
+        for path, rev_range in self.ranges.values():
+            l += int(gitlog.git(path, "rev-list", "--count", rev_range, "--"))
         return l
 
+    def iter_commits(self, fields):
+        """Yield (project, values of fields) per commit of every project.
+
+        fields are `git log` placeholders (see gitlog.iter_fields); the
+        projects are walked one after the other as values are consumed.
+        """
+        for project in self.ranges:
+            for values in profiling.timed(
+                    "commit walk", gitlog.iter_fields(*self.ranges[project],
+                                                      fields=fields)):
+                yield project, values
+
     def count_git_changes(self):
-        l = 0
-        for project in self.git_changes:
-            l += len(self.git_changes[project])
-        return l
+        return len(self.git_changes)
 
 
     def init_gerrit_changes(self, exclude_merge=True, include_domain="sony"):
         self.gerrit_changes = []
-        for project in self.commits:
-            for c in self.commits[project]:
-                try:
-                    is_merge = len(c.parents) is 2
-                    if is_merge and exclude_merge:
-                        continue
-                    else:
-                        hexsha = c.hexsha
-                        domain = re.sub(pattern="^.*@",
-                                        repl="", string=c.author.email)
-                        if include_domain in domain:
-                            self.gerrit_changes.append(hexsha)
-                except LookupError:
-                    print "Warning: Encoding issue"
-                    pass
-
-    def get_gerrit_changes(self, nmax=75):
-        n = len(self.gerrit_changes)  # n = d*nmax+r
-        d = n / nmax
-        r = n % nmax
-        C = None
-        i_end = 0
-        for i in range(d):
-            i_start = i * nmax
-            i_end = (i + 1) * nmax
-            B = gerrit.Base(numbers=self.gerrit_changes[i_start:i_end],
-                            dst="result-gerrit")
-            if C:
-                C.merge(gerrit.Changes(B))
-            else:
-                C = gerrit.Changes(B)
-            print i_start, i_end
-        if r is not 0:
-            i_start = i_end
-            i_end = i_end + r
-            B = gerrit.Base(numbers=self.gerrit_changes[i_start:i_end],
-                            dst="result-gerrit")
-            if C:
-                C.merge(gerrit.Changes(B))
+        for project, (hexsha, parents, email) in self.iter_commits(
+                ("%H", "%P", "%ae")):
+            is_merge = len(parents.split()) is 2
+            if is_merge and exclude_merge:
+                continue
+            domain = re.sub(pattern="^.*@", repl="", string=email)
+            if include_domain in domain:
+                self.gerrit_changes.append(hexsha)
+
+    def get_gerrit_changes(self, nmax=75, workers=1, retries=3,
+                           url=gerrit.SOMCGR, netrc=True, export=None,
+                           cache=None, offline=False, adaptive=True,
+                           max_url=8000, target=2.0, req=None,
+                           checkpoint=None, shard=None):
+        """Query Gerrit for self.gerrit_changes.
+
+        Without `export` all data is kept in self.Changes; with a
+        gerrit.Export every batch is written out and dropped instead.
+        With a ChangeCache only missing or open changes are queried and
+        every answer is stored; cached changes are read nmax at a time
+        and come first.  `offline` uses the cache alone.  With
+        `adaptive` nmax is only the first batch size, see
+        gerrit.BatchSizer for max_url and target.  An existing session
+        `req` is used instead of connecting to url.  With a Checkpoint
+        every exported batch is committed to it, and SHAs it already
+        holds are not queried again; the SHAs of an open cached change
+        are committed with the batch querying its number again.
+
+        Gerrit is asked only for what the tables of `export` need (see
+        gerrit.query_options); such partial answers are not stored in
+        the cache, which keeps complete changes only, nor taken as
+        misses.  With a
+        shards.Shard only its range of self.gerrit_changes is queried.
+        """
+        n = len(self.gerrit_changes)
+        if offline:
+            netrc = False
+        if req is None:
+            req = gerrit.connect(url, netrc=netrc, pool_size=workers)
+        numbers = self.gerrit_changes
+        if shard is not None:
+            start, stop = shard.range(n, nmax)
+            numbers = numbers[start:stop]
+            print "Shard %s: %d-%d" % (shard, start, stop)
+        if checkpoint is not None:
+            numbers = [x for x in numbers if x not in checkpoint]
+            if checkpoint.resumed:
+                print "Resumed: %d" % (n - len(numbers))
+        batches = []
+        requery = {}
+        if cache is not None:
+            cached, rest, shas = cache.split(numbers, stale_ok=offline)
+            done = set(rest)
+            for x in shas:
+                done.update(shas[x])
+            # SHAs of open changes are done with the batch querying them
+            requery = dict((x, shas[x]) for x in rest if x in shas)
+            # Misses first: nothing to write for them
+            B = gerrit.Base(numbers=[], dst="result-gerrit", req=req)
+            batches = itertools.chain(
+                [([x for x in numbers if x not in done],
+                  gerrit.Changes(B, data=[]))],
+                _cached_batches(cache, cached, shas, nmax, B))
+            numbers = rest
+            print "Cached: %d" % len(cached)
+        if offline:
+            print "Skipped: %d" % len(numbers)
+            numbers = []
+        options = gerrit.QUERY_OPTIONS
+        if export is not None:
+            options = export.options()
+        sizer = None
+        if adaptive:
+            sizer = gerrit.BatchSizer(req, nmax, max_url, target, options)
+        fetched = gerrit.iter_changes(numbers, nmax=nmax, workers=workers,
+                                      retries=retries, req=req,
+                                      dst="result-gerrit", sizer=sizer,
+                                      options=options)
+        batches = itertools.chain(batches, (
+            (changes.base.numbers + [sha for x in changes.base.numbers
+                                     for sha in requery.get(x, ())], changes)
+            for changes in fetched))
+        self.Changes = None
+        found = 0
+        for terms, changes in batches:
+            found += len(changes.data)
+            if cache is not None and changes.base.numbers:
+                if options == gerrit.QUERY_OPTIONS:
+                    changes.data = cache.put(changes.data)
+                    cache.put_misses(changes.base.numbers, changes.data)
+            if export is not None:
+                export.write(changes.data)
+                if checkpoint is not None:
+                    checkpoint.commit(terms, export.outputs())
+            elif self.Changes:
+                self.Changes.merge(changes)
             else:
-                C = gerrit.Changes(B)
-        self.Changes = C
+                self.Changes = changes
         print "Total: %d" % n
-        print "Found: %d" % len(self.Changes.data)
+        print "Found: %d" % found
+
+    def mine(self, miner, exclude_merge, filetype, workers=1, cache=None,
+             projects=None):
+        """Yield (project, miner result) for every project in order.
 
-    def init_git_changes(self, exclude_merge=True, filetype=FILE_TYPE):
-        self.git_changes = {}
+        With workers > 1 each project is mined in its own process; the
+        results still come back in the order of self.ranges, or of
+        `projects` if only those are wanted.  Commits found in the
+        CommitCache `cache` are not read from git again.
+        """
+        if projects is None:
+            projects = list(self.ranges)
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            jobs = [(miner, project) + self.ranges[project] +
+                    (exclude_merge, filetype, cache) for project in projects]
+            try:
+                results = profiling.merged(
+                    pool.imap(profiling.Worker(_mine_project), jobs))
+                for project, result in itertools.izip(projects, results):
+                    print "%d commits (%s)" % (result[1], project)
+                    yield project, result
+            finally:
+                pool.terminate()
+        else:
+            progress = 0
+            for project in projects:
+                commits = profiling.timed(
+                    "commit walk", gitlog.iter_commits(*self.ranges[project],
+                                                       cache=cache))
+                result = MINERS[miner](project, commits,
+                                       exclude_merge, filetype, progress)
+                progress += result[1]
+                yield project, result
+
+    def mine_into(self, miner, exclude_merge, filetype, workers=1,
+                  cache=None, table=None, checkpoint=None, keep=True):
+        """Like mine(), writing every project out as soon as it is mined.
+
+        Its rows go to the writers table `table` and it is committed to
+        the Checkpoint `checkpoint` then, with its records if `keep`.
+        Projects the checkpoint already holds are not mined again; their
+        saved result comes back instead, without records unless `keep`.
+        """
+        projects = list(self.ranges)
+        todo = projects
+        if checkpoint is not None:
+            todo = [p for p in projects if p not in checkpoint]
+            if checkpoint.resumed:
+                print "Resumed: %d projects" % (len(projects) - len(todo))
+        results = self.mine(miner, exclude_merge, filetype, workers, cache,
+                            todo)
+        for project in projects:
+            if project not in todo:
+                yield project, checkpoint.load(project)
+                continue
+            project, result = next(results)
+            records = result[0]
+            if table is not None:
+                records.segment(project, 0)
+                if miner == "changes":
+                    stats.commit_stats(records)
+                with profiling.stage("write"):
+                    table.writerows(records.rows(project))
+            if not keep:
+                result = (type(records)(),) + result[1:]
+            if checkpoint is not None:
+                checkpoint.commit([project], [table] if table else [],
+                                  result)
+            yield project, result
+
+    def init_git_changes(self, exclude_merge=True, filetype=FILE_TYPE,
+                         workers=1, cache=None, table=None,
+                         checkpoint=None):
+        """Mine every project into self.git_changes.
+
+        See mine_into() for `table` and `checkpoint`.
+        """
+        self.git_changes = ChangeRecords()
         progress = 0
         num_merge = 0
-        for project in self.commits:
-            self.git_changes[project] = []
-            for c in self.commits[project]:
-                progress += 1
-                print "%d, %s (%s) " % (progress, c.hexsha[0:7], project)
-                try:
-                    is_merge = len(c.parents) is 2
-                    num_merge += is_merge
-                    filtered_files = filter_files(filetype, c.stats.files)
-                    if is_merge and exclude_merge:
-                        continue
-                    nol = 0
-                    nof = 0
-                    ent = 0.0 # Shannon entropy
-
-                    for f in filtered_files:
-                        nol += filtered_files[f]['lines']
-                        nof += 1
-                    for f in filtered_files:  # Entropy calculation
-                        p = 1.0 * filtered_files[f]['lines'] / nol
-                        ent += -1.0 * p * math.log(p, 2)
-                    if ent != 0.0:
-                        ent = ent / math.log(nof, 2)  # Normalization
-                    N = len(filtered_files)
-                    self.git_changes[project].append(
-                                        {'hexsha': c.hexsha,
-                                        'merge': is_merge,
-                                        'author': c.author.email,
-                                        'authored_date': c.authored_date,
-                                        'committer': c.committer.email,
-                                        'committed_date': c.committed_date,
-                                        'files': nof,
-                                        'lines': nol,
-                                        'entropy': ent,
-                                        'message': c.message
-                                        })
-                except LookupError:
-                    print "Warning: Encoding issue"
-                    pass
-            if len(self.git_changes[project]) is 0:
-                del self.git_changes[project]
+        for project, result in self.mine_into("changes", exclude_merge,
+                                              filetype, workers, cache,
+                                              table, checkpoint):
+            self.git_changes.extend(project, result[0])
+            progress += result[1]
+            num_merge += result[2]
+            if len(result[0]) is 0:
+                self.git_changes.discard(project)
+        stats.commit_stats(self.git_changes)
         print "Total: %d" % progress
         print "Merge: %d" % num_merge
 
-    def measure_git(self, filename="test.csv"):
-        with open(filename, 'w') as fp:
-            a = csv.writer(fp)
-            a.writerow(('project', 'hexsha', 'merge', 'author', 'authored_date',
-                        'committer', 'committed_date', 'files', 'lines',
-                        'entropy', 'message'))
-            for project in self.git_changes:
-                for c in self.git_changes[project]:
-                    ad = time.strftime(DATE_FORMAT,
-                                       time.gmtime(c['authored_date']))
-                    cd = time.strftime(DATE_FORMAT,
-                                       time.gmtime(c['committed_date']))
-                    message = unicode(c['message']).encode("utf-8")
-                    row = (project, c['hexsha'], c['merge'], c['author'], ad,
-                           c['committer'], cd, c['files'], c['lines'],
-                           c['entropy'], message)
-                    a.writerow(row)
-
-    def init_git_files(self, exclude_merge=True, filetype=".*"):
-        self.git_files = {}
+    def measure_git(self, filename="test.csv", fmt='csv'):
+        with profiling.stage("write"):
+            a = self.open_table(filename, GIT_COLUMNS, fmt)
+            try:
+                for project in self.git_changes:
+                    self.part(a, project)
+                    a.writerows(self.git_changes.rows(project))
+            finally:
+                a.close()
+
+    def init_git_files(self, exclude_merge=True, filetype=".*", workers=1,
+                       cache=None, table=None, checkpoint=None):
+        """Mine every project into self.git_files.
+
+        With a `table` the rows are written out as each project comes
+        and not kept; see mine_into() for that and `checkpoint`.
+        """
+        self.git_files = FileRecords()
         progress = 0
         num_merge = 0
-        for project in self.commits:
-            self.git_files[project] = []
-            for c in self.commits[project]:
-                progress += 1
-                print "%d, %s (%s) " % (progress, c.hexsha[0:7], project)
-                try:
-                    is_merge = len(c.parents) is 2
-                    num_merge += is_merge
-                    filtered_files = filter_files(filetype, c.stats.files)
-                    if is_merge and exclude_merge:
-                        continue
-
-                    for f in filtered_files:
-                        deletions = filtered_files[f]['deletions']
-                        insertions = filtered_files[f]['insertions']
-                        lines = filtered_files[f]['lines']
-                        self.git_files[project].append(
-                                        {'hexsha': c.hexsha,
-                                         'file': f,
-                                         'deletions': deletions,
-                                         'lines': lines,
-                                         'insertions': insertions
-                                        })
-                except LookupError:
-                    print "Warning: Encoding issue"
-                    pass
+        for project, result in self.mine_into("files", exclude_merge,
+                                              filetype, workers, cache,
+                                              table, checkpoint,
+                                              keep=table is None):
+            self.git_files.extend(project, result[0])
+            progress += result[1]
+            num_merge += result[2]
         print "Total: %d" % progress
         print "Merge: %d" % num_merge
 
-    def measure_files(self, filename="test.csv"):
-        with open(filename, 'w') as fp:
-            a = csv.writer(fp)
-            a.writerow(('hexsha', 'file', 'lines', 'insertions', 'deletions'))
-            for project in self.git_files:
-                for f in self.git_files[project]:
-                    row = (f['hexsha'], f['file'], f['lines'],
-                           f['insertions'], f['deletions'])
-                    a.writerow(row)
+    def measure_files(self, filename="test.csv", fmt='csv'):
+        with profiling.stage("write"):
+            a = self.open_table(filename, FILES_COLUMNS, fmt)
+            try:
+                for project in self.git_files:
+                    self.part(a, project)
+                    a.writerows(self.git_files.rows(project))
+            finally:
+                a.close()
 
 
     def summarize_git_changes(self):
-        self.git_summary = {}
-        for project in self.git_changes:
-            noc = len(self.git_changes[project])  # commit
-            authors = []
-            nol = 0
-            nof = 0
-            for c in self.git_changes[project]:
-                nol += c['lines']
-                nof += c['files']
-                authors.append(c['author'])
-            noa = len(set(authors))
-            self.git_summary[project] = {'noc': noc, 'nof': nof,
-                                         'nol': nol, 'noa': noa}
+        with profiling.stage("stats"):
+            self.git_summary = stats.project_summary(self.git_changes)
+
+    def measure_summary(self, filename="test.csv", fmt='csv'):
+        with profiling.stage("write"):
+            a = self.open_table(filename, SUMMARY_COLUMNS, fmt)
+            try:
+                for project in self.git_changes:
+                    self.part(a, project)
+                    s = self.git_summary[project]
+                    a.writerow((project, s['noc'], s['nof'], s['nol'],
+                                s['noa'], s['entropy'], s['first'],
+                                s['last']))
+            finally:
+                a.close()
+
+    def people_order(self):
+        """Return {place of project: its people by first appearance}.
+
+        The whole run numbers people in that order over the projects in
+        turn, and lists authors by number; see shards.part_keys().
+        """
+        records = self.git_changes
+        names = records.people.values
+        people = {}
+        for project in records:
+            seen = Interner()
+            for i in xrange(*records.segments[project]):
+                seen.code(names[records.author[i]])
+                seen.code(names[records.committer[i]])
+            people[str(self.order[project])] = seen.values
+        return people
+
+    def measure_authors(self, filename="test.csv", fmt='csv'):
+        with profiling.stage("write"):
+            rows = stats.author_rows(self.git_changes)
+            if self.sharding is None:
+                a = writers.open_table(filename, AUTHORS_COLUMNS, fmt)
+            else:
+                a = self.open_table(filename, AUTHORS_COLUMNS, fmt,
+                                    people=self.people_order())
+                rows = shards.grouped(a, rows, lambda row:
+                                      [self.order[row[0]], row[1]])
+            try:
+                a.writerows(rows)
+            finally:
+                a.close()
+
+    def measure_rates(self, filename="test.csv", window=7 * stats.DAY,
+                      fmt='csv'):
+        with profiling.stage("write"):
+            a = self.open_table(filename, RATES_COLUMNS, fmt)
+            rows = stats.rate_rows(self.git_changes, window)
+            if self.sharding is not None:
+                rows = shards.grouped(a, rows,
+                                      lambda row: [self.order[row[0]]])
+            try:
+                a.writerows(rows)
+            finally:
+                a.close()
     def print_summary(self):
         for project in self.git_summary:
             print "===== %s =====" % project
-            print self.git_summary[project]
\ No newline at end of file
+            print self.git_summary[project]
+
+
+class ManifestSeries(object):
+
+    """Consecutive manifest pairs of a series, handled in one process.
+
+    The manifests are parsed once and diffed in one pass; repositories
+    are looked up once for all pairs.
+    """
+
+    def __init__(self, files, repo_path=".", cache=None):
+        self.files = files
+        self.repo_path = repo_path
+        self.diffs = manifests.diff_series([manifests.load(f, cache)
+                                            for f in files])
+        self.repos = {}
+
+    def spans(self):
+        """Return project -> (path, revisions) covering all its ranges.
+
+        The span runs from the first left revision of a project to all
+        of its right revisions.  It holds every commit of the ranges as
+        long as the series moves forward in history.
+        """
+        spans = {}
+        for diff in self.diffs:
+            for project in diff:
+                info = diff[project]
+                if project not in spans:
+                    spans[project] = (info['path'], ["^" + info['lrev']])
+                spans[project][1].append(info['rrev'])
+        return spans
+
+    def load_spans(self, cache, workers=1, shard=None):
+        """Walk every project span once into the CommitCache `cache`.
+
+        Ranges of the pairs then come out of the cache and only need a
+        `git rev-list`; commits outside the span are still read as
+        usual.  With a shards.Shard only its projects are walked.
+        Return the number of commits walked.
+        """
+        jobs = []
+        spans = self.spans()
+        for project in spans:
+            if shard is not None and not shard.has(project):
+                continue
+            path, revs = spans[project]
+            working_dir = find_repo(os.path.join(self.repo_path, path),
+                                    self.repos)
+            if working_dir is not None:
+                jobs.append((working_dir, revs, cache))
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            try:
+                return sum(profiling.merged(pool.imap_unordered(
+                    profiling.Worker(_load_span), jobs)))
+            finally:
+                pool.terminate()
+        return sum(_load_span(job) for job in jobs)
+
+    def pairs(self):
+        """Yield (lmani, rmani, RepoCommits) for every consecutive pair."""
+        for i, diff in enumerate(self.diffs):
+            yield (self.files[i], self.files[i + 1],
+                   RepoCommits(diff, self.repo_path, self.repos))
@@ -0,0 +1,201 @@
+""" Table writers for get-data output: CSV or typed columnar files.
+
+A table is described by its columns, a sequence of (name, kind) pairs.
+Rows hold raw values; each backend renders them by kind:
+
+    int, float, bool  numbers as they are
+    str               free text, written verbatim
+    text              free text; CSV replaces '"' by '``' (see rm_quotes)
+    category          few distinct strings; dictionary-encoded in columns
+    epoch             seconds since 1970; CSV prints it with DATE_FORMAT
+    gerrit_time       Gerrit "YYYY-MM-DD hh:mm:ss.nnnnnnnnn" string or ''
+"""
+
+import calendar
+import csv
+import os
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+DATE_FORMAT = '%Y/%m/%d %H:%M:%S'
+FORMATS = ('csv', 'parquet', 'arrow')
+EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+def utf8(value):
+    """Return unicode value encoded in UTF-8, anything else unchanged."""
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+
+def csv_text(value):
+    """Return value with '"' replaced by '``', encoded in UTF-8."""
+    return utf8(value.replace('"', '``'))
+
+
+def csv_epoch(value):
+    return time.strftime(DATE_FORMAT, time.gmtime(value))
+
+
+CSV_CONVERTERS = {'str': utf8, 'category': utf8, 'text': csv_text,
+                  'epoch': csv_epoch}
+
+
+def table_path(filename, fmt):
+    """Return filename with the extension of fmt instead of its own."""
+    if fmt == 'csv':
+        return filename
+    return os.path.splitext(filename)[0] + EXTENSIONS[fmt]
+
+
+def open_table(filename, columns, fmt='csv', append=False, **options):
+    """Return a writer of fmt for a table of columns at filename.
+
+    With `append` rows go after those already in the file; only CSV
+    tables can be appended to.
+    """
+    if fmt == 'csv':
+        return CsvTable(filename, columns, append)
+    if append:
+        raise Exception("Cannot append to %s output" % fmt)
+    if fmt in ('parquet', 'arrow'):
+        return ColumnarTable(table_path(filename, fmt), columns, fmt,
+                             **options)
+    raise Exception("Unknown output format %s (use %s)" %
+                    (fmt, "/".join(FORMATS)))
+
+
+class CsvTable(object):
+
+    """Write rows to a CSV file with a header line.
+
+    With `append` rows are added to an existing file, which gets the
+    header only if it is empty.
+    """
+
+    def __init__(self, path, columns, append=False):
+        self.path = path
+        self.fp = open(path, 'a' if append else 'w')
+        self.fp.seek(0, os.SEEK_END)
+        self.writer = csv.writer(self.fp)
+        if self.fp.tell() == 0:
+            self.writer.writerow([name for name, kind in columns])
+        self.converters = [(i, CSV_CONVERTERS[kind])
+                           for i, (name, kind) in enumerate(columns)
+                           if kind in CSV_CONVERTERS]
+
+    def writerow(self, row):
+        if self.converters:
+            row = list(row)
+            for i, f in self.converters:
+                row[i] = f(row[i])
+        self.writer.writerow(row)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        self.fp.flush()
+
+    def size(self):
+        """Return the bytes written so far, header included."""
+        return self.fp.tell()
+
+    def close(self):
+        self.fp.close()
+
+
+def gerrit_ns(value):
+    """Return a Gerrit timestamp as nanoseconds since 1970, '' as None."""
+    if not value:
+        return None
+    seconds = calendar.timegm(time.strptime(value[:19], "%Y-%m-%d %H:%M:%S"))
+    return seconds * 1000000000 + int(value[20:29].ljust(9, "0"))
+
+
+def _unicode(value):
+    if isinstance(value, str):
+        return value.decode("utf-8", "replace")
+    return value
+
+
+class ColumnarTable(object):
+
+    """Write rows as Parquet or Arrow IPC record batches of batch_size rows.
+
+    Timestamps become UTC timestamp columns, category columns are
+    dictionary-encoded and Parquet pages are compressed with `compression`.
+    """
+
+    def __init__(self, path, columns, fmt='parquet', batch_size=65536,
+                 compression='snappy'):
+        if pa is None:
+            raise Exception("pyarrow is needed for %s output" % fmt)
+        self.path = path
+        self.columns = columns
+        self.batch_size = batch_size
+        self.rows = []
+        fields = []
+        for name, kind in columns:
+            if kind == 'int':
+                t = pa.int64()
+            elif kind == 'float':
+                t = pa.float64()
+            elif kind == 'bool':
+                t = pa.bool_()
+            elif kind == 'category':
+                t = pa.dictionary(pa.int32(), pa.string())
+            elif kind == 'epoch':
+                t = pa.timestamp('s', tz='UTC')
+            elif kind == 'gerrit_time':
+                t = pa.timestamp('ns', tz='UTC')
+            else:
+                t = pa.string()
+            fields.append(pa.field(name, t))
+        self.schema = pa.schema(fields)
+        if fmt == 'parquet':
+            self.writer = pq.ParquetWriter(path, self.schema,
+                                           compression=compression)
+        else:
+            self.writer = pa.RecordBatchFileWriter(path, self.schema)
+
+    def writerow(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if not self.rows:
+            return
+        arrays = []
+        for i, (name, kind) in enumerate(self.columns):
+            values = [row[i] for row in self.rows]
+            if kind == 'gerrit_time':
+                values = [gerrit_ns(v) for v in values]
+            elif kind in ('str', 'text', 'category'):
+                values = [_unicode(v) for v in values]
+            if kind == 'category':
+                arrays.append(pa.array(values, pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, self.schema[i].type))
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if isinstance(self.writer, pq.ParquetWriter):
+            self.writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()